@@ -1,38 +1,167 @@
 import streamlit as st
-from prom_functions import (
-    generate_company_information,
-    generate_corp_code,
-    short_list, # Note: short_list is imported in the new code but get_dart_company_information is used first for DART.
-    sec_search,
-    sec_get_report,
-    dart_search,
-    dart_get_report,
-    get_dart_company_information # Ensure this function is defined in your prom_functions.py
-)
-import io
+import json
 import asyncio
+import atexit
+import collections
+import concurrent.futures
+import contextlib
+import contextvars
+import hashlib
+import html
 import os
-import nest_asyncio
+import re
+import shutil
+import threading
 import tempfile
-from google.genai import Client, types # Assuming this is the correct client for chat_object
-from load_files import process_files_and_get_chat_object
 from dotenv import load_dotenv
 load_dotenv()
-from sec_tool import sec_tool_function
-from web_search import web_search_tool
-from combined_tool import get_answer_to_query
+# prom_functions, load_files, sec_tool, web_search, google.genai and docx are heavy to import,
+# so they are imported where they're used and each page only pays for what it needs
+from report_cache import REPORT_DOCX_FILE, Cacher, ReportStore, report_cache_key
+from google_client import get_google_client
+from chat_store import deserialize_message, get_chat_store, serialize_history
 import traceback
-from docx import Document
-from docx.shared import Inches
-from docx.enum.table import WD_TABLE_ALIGNMENT
-from docx.enum.text import WD_ALIGN_PARAGRAPH
-# Apply nest_asyncio to handle asyncio in Streamlit
-nest_asyncio.apply()
+import uuid
+import weakref
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
 
 # --- Page Constants ---
 PAGE_REPORT_GENERATOR = "Report Generator"
 PAGE_COMBINED_CHAT = "Chat With Tools"
 
+# Shown on the report page until a report is generated or selected.
+# Built once at import, already dedented, so each render just sends the string.
+WELCOME_MD = """
+## Welcome to the Investment Report Generator! 👋
+
+This application helps you generate comprehensive investment reports for companies using:
+
+- **SEC Filings** (for English/US companies)
+- **DART Filings** (for Korean companies)
+
+### How to use:
+1. Select your preferred **filings type** (Global SEC or Korean DART) above.
+2. Enter the **company's website URL** in the input field.
+3. Click "**🚀 Generate Report**" to start the analysis.
+
+### Features:
+- 🔍 Automatic company information extraction
+- 📄 Filing search and analysis
+- 📊 Comprehensive investment memorandum generation
+- 🖼️ Visual report elements (if generated)
+- 📥 Download reports as markdown files
+
+**Get started by filling out the details above!**
+"""
+
+# Information memorandum prompt, filled in per company by build_im_query
+ENGLISH_IM_TEMPLATE = """As an investment associate, draft an information memorandum for company: {full_name}
+Information of Company: {company_data}
+
+-ADD These in table of contents:
+
+These are the Headings you need to use for IM and then generate sub headings for each heading
+1.Executive Summary
+2.Investment Highlights
+3.Company Overview
+    Introduction to {full_name}
+    History, Mission, and Core Values
+    Global Presence and Operations
+4.Business Model, Strategy, and Product
+5.Business Segments Deep Dive
+6.Industry Overview and Competitive Positioning
+7.Financial Performance Analysis
+    Revenue
+    {finance_report}
+8.Management and Corporate Governance
+9.Strategic Initiatives and Future Growth Drivers
+10.Risk Factors
+11.Investment Considerations
+12.Conclusion
+13.References (Filings Annual Report, Accurate and Authentic)
+
+-Add Tables: Display structured data like numbers, dates, comparisons, or lists in a table with headers, then summarize its main takeaways. For other content, use bullet points or numbered lists.
+
+-(Please exclude SWOT analysis)
+"""
+
+# Uploads larger than this are rejected before anything is written to disk
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_MB", "200")) * 1024 * 1024
+UPLOAD_COPY_CHUNK_BYTES = 1024 * 1024
+
+# Characters replaced by '_' when a company name is used in a file name
+FILENAME_UNSAFE_CHARS = re.compile(r'[ /\\]')
+
+# Line breaks write_multiline_text doubles for markdown
+LINE_BREAK_RE = re.compile(r'\r\n|\r|\n')
+
+# Line prefixes markdown_to_docx turns into Word styles: "# " to "#### " headings, "- " / "* " bullets
+# and "1. " to "9. " numbered items. Matched in one pass instead of a chain of startswith checks.
+MARKDOWN_LINE_RE = re.compile(r'(?P<hashes>#{1,4}) (?P<heading>.*)|[-*] (?P<bullet>.*)|[1-9]\. (?P<numbered>.*)')
+
+# Progress messages only appear for steps slower than this, and change wording after SLOW_STEP_SECONDS
+SPINNER_DELAY_SECONDS = 0.2
+SLOW_STEP_SECONDS = 3.0
+
+# How often the page checks on reports generated in the background
+BACKGROUND_POLL_SECONDS = 2
+
+# Threads building DOCX downloads in the background, shared by all sessions
+DOCX_BUILD_WORKERS = 2
+
+# Number of chat turns rendered at once; older ones are paged in from the chat store
+CHAT_HISTORY_WINDOW = 20
+
+# URL query parameter holding the id a browser's documents and chats are stored under
+CHAT_OWNER_PARAM = "session"
+CHAT_OWNER_RE = re.compile(r'[0-9a-f]{32}')
+
+# Reports listed per session; the oldest drops off the list (it stays in the disk cache)
+REPORT_LIST_MAX_ENTRIES = int(os.getenv("REPORT_LIST_MAX_ENTRIES", "50"))
+# web_search_reason values where the web report replaced DART because something failed, not because
+# the company isn't in DART; such reports aren't resumed from the disk cache
+TRANSIENT_WEB_SEARCH_REASONS = {"error in dart lookup", "corp code generation failed", "no dart documents"}
+
+# uvloop is optional (not available on Windows); it replaces the default selector loop when installed
+try:
+    import uvloop
+    new_event_loop = uvloop.new_event_loop
+except ImportError:
+    new_event_loop = asyncio.new_event_loop
+
+# Disk cache shared by all sessions, keyed by sha256(company_url|language)
+report_cacher = Cacher()
+# In-memory LRU of full reports; session state only holds small summaries and cache keys
+report_store = ReportStore(report_cacher)
+
+def _run_event_loop(event_loop):
+    """Runs event_loop until it is stopped, then cancels the tasks left on it and closes it."""
+    asyncio.set_event_loop(event_loop)
+    try:
+        event_loop.run_forever()
+        pending = asyncio.all_tasks(event_loop)
+        for task in pending:
+            task.cancel()
+        event_loop.run_until_complete(asyncio.gather(*pending, return_exceptions=True))
+        event_loop.run_until_complete(event_loop.shutdown_asyncgens())
+    finally:
+        event_loop.close()
+
+class SessionEventLoop():
+    """
+    A session's event loop, running in its own daemon thread.
+
+    Each session gets its own loop (and thread) because run_async attaches the calling
+    script's run context to the loop thread, which can't be shared between sessions.
+    The object lives in session state; once the session is gone and it is garbage
+    collected, the loop is stopped and closed so threads don't pile up.
+    """
+    def __init__(self):
+        self.loop = new_event_loop()
+        threading.Thread(target=_run_event_loop, args=(self.loop,), name="session-event-loop", daemon=True).start()
+        # The finalizer must not reference self, only the loop
+        weakref.finalize(self, self.loop.call_soon_threadsafe, self.loop.stop)
+
 # --- Page Configuration and Session State Initialization ---
 
 def setup_page_config():
@@ -45,22 +174,22 @@ def setup_page_config():
 
 def init_session_state():
     """Initializes session state variables if they don't exist."""
-    if 'report_list' not in st.session_state:
-        st.session_state.report_list = []
-    if 'report_to_display' not in st.session_state:
+    if 'report_list' not in st.session_state: # Report summaries, see add_report_to_list
+        st.session_state.report_list = collections.deque(maxlen=REPORT_LIST_MAX_ENTRIES)
+    if 'report_index' not in st.session_state: # (url, language) -> report summary, mirrors report_list
+        st.session_state.report_index = {}
+    if 'transient_reports' not in st.session_state: # cache_key -> report_data of listed reports that can't be resumed from disk
+        st.session_state.transient_reports = {}
+    if 'report_to_display' not in st.session_state: # cache_key of the report shown in the details section
         st.session_state.report_to_display = None
     if 'current_page' not in st.session_state:
         st.session_state.current_page = PAGE_REPORT_GENERATOR
-    if 'uploaded_files' not in st.session_state: # Renamed from uploaded_pdfs
-        st.session_state.uploaded_files = [{"name": "Web Search Tool", "path": "", "id": "Web Search Tool", 'tools_list': [web_search_tool]}, {"name":"SEC Filings Search Tool", "path":"", "id":"SEC Filings Search Tool", "tools_list":[sec_tool_function]}]
     if 'selected_file_for_chat' not in st.session_state: # Renamed from selected_pdf_for_chat
         st.session_state.selected_file_for_chat = None
     if 'last_filings_selection' not in st.session_state:
         st.session_state.last_filings_selection = "Global SEC filings"
     if 'last_company_url' not in st.session_state:
         st.session_state.last_company_url = ""
-    if 'google_client' not in st.session_state:
-        st.session_state.google_client = Client()
     if 'last_statement_types' not in st.session_state:
         st.session_state.last_statement_types = ["Income Statement"]
     if 'sec_agent_query_answer' not in st.session_state:
@@ -69,26 +198,250 @@ def init_session_state():
         st.session_state.chat_objects = {}
     if 'selected_chat_name' not in st.session_state:
         st.session_state.selected_chat_name = None
+    if 'docx_builds' not in st.session_state: # cache_key -> Future of a report_docx_path run started by add_report_to_list
+        st.session_state.docx_builds = {}
+    if 'background_reports' not in st.session_state: # (url, language) -> Future of a background run_report_pipeline run
+        st.session_state.background_reports = {}
+    if 'background_report_errors' not in st.session_state:
+        st.session_state.background_report_errors = []
+    if 'dart_cache_dir' not in st.session_state:
+        # Kept for the whole session so a company's DART statements are written to disk only once
+        dart_cache_dir = tempfile.mkdtemp(prefix="dart_")
+        atexit.register(shutil.rmtree, dart_cache_dir, ignore_errors=True)
+        st.session_state.dart_cache_dir = dart_cache_dir
+    if 'event_loop' not in st.session_state:
+        # One long-lived loop per session so async clients keep their connection pools across reruns
+        st.session_state.event_loop = SessionEventLoop()
+
+
+def chat_owner_id():
+    """
+    Returns the id this session's documents and chats are stored under in the chat store.
+
+    It is a random id kept in the page URL, so reloading the page restores the session's
+    documents and chats while other sessions (which get their own id) never see them.
+    """
+    if 'chat_owner_id' not in st.session_state:
+        owner = st.query_params.get(CHAT_OWNER_PARAM, "")
+        if not CHAT_OWNER_RE.fullmatch(owner):
+            owner = uuid.uuid4().hex
+            st.query_params[CHAT_OWNER_PARAM] = owner
+        st.session_state.chat_owner_id = owner
+    return st.session_state.chat_owner_id
+
+def init_chat_tools_state():
+    """Initializes the chat page state. Kept out of init_session_state so the tool modules are only imported on the chat page."""
+    if 'uploaded_files' not in st.session_state: # Renamed from uploaded_pdfs
+        from sec_tool import sec_tool_function
+        from web_search import web_search_tool
+        st.session_state.uploaded_files = [{"name": "Web Search Tool", "path": "", "id": "Web Search Tool", 'tools_list': [web_search_tool]}, {"name":"SEC Filings Search Tool", "path":"", "id":"SEC Filings Search Tool", "tools_list":[sec_tool_function]}]
+        # Documents processed earlier (also before a restart) are listed again; their tools are built on first use
+        known_names = {file['name'] for file in st.session_state.uploaded_files}
+        for file_info in get_chat_store().list_files(chat_owner_id()):
+            if file_info['name'] not in known_names:
+                st.session_state.uploaded_files.append(file_info)
+                known_names.add(file_info['name'])
+    if 'uploaded_files_by_name' not in st.session_state: # name -> file info, mirrors uploaded_files
+        st.session_state.uploaded_files_by_name = {file['name']: file for file in st.session_state.uploaded_files}
+    if 'chats_restored' not in st.session_state:
+        restore_chats()
+        st.session_state.chats_restored = True
+
+
+def new_chat_entry(chat_id, tool_ids, tool_names, chat_object=None):
+    """Returns the session state entry of a chat. Restored chats get their chat_object on first use, see open_chat."""
+    return {
+        'chat_object': chat_object,
+        'tool_ids': tool_ids, # Ids of the uploaded_files entries the chat's tools come from
+        'tool_names': tool_names,
+        'chat_id': chat_id, # Key in the chat store
+        'synced_history_len': 0, # Messages of get_history() already written to the chat store
+        'render_limit': CHAT_HISTORY_WINDOW,
+        'recent_messages': None # In-memory window of stored messages, reloaded after each send
+    }
+
+def restore_chats():
+    """
+    Lists the chats kept in the chat store (also from before a restart) in the session.
+    Chats whose documents are gone can't be rebuilt, so they are deleted from the store.
+    """
+    chat_store = get_chat_store()
+    owner = chat_owner_id()
+    files_by_id = {file['id']: file for file in st.session_state.uploaded_files}
+    for chat in chat_store.list_chats(owner):
+        if not all(tool_id in files_by_id for tool_id in chat['tool_ids']):
+            chat_store.delete_chat(owner, chat['chat_id'])
+        elif chat['name'] not in st.session_state.chat_objects:
+            tool_names = [files_by_id[tool_id]['name'] for tool_id in chat['tool_ids']]
+            st.session_state.chat_objects[chat['name']] = new_chat_entry(chat['chat_id'], chat['tool_ids'], tool_names)
+
+def get_file_tools(file_info):
+    """Returns a document's chat tools, building them on first use for documents restored from the chat store."""
+    if 'tools_list' not in file_info:
+        file_info['tools_list'] = build_chat_tools(file_info['id'], file_info['path'], get_google_client())
+    return file_info['tools_list']
+
+def open_chat(chat_entry):
+    """Returns the chat's Gemini chat object, recreating a restored chat with its tools and stored history on first use."""
+    if chat_entry['chat_object'] is None:
+        chat_store = get_chat_store()
+        files_by_id = {file['id']: file for file in st.session_state.uploaded_files}
+        with st.spinner("Restoring chat..."):
+            tools = [tool for tool_id in chat_entry['tool_ids'] for tool in get_file_tools(files_by_id[tool_id])]
+            owner = chat_owner_id()
+            stored_messages = chat_store.load_messages(owner, chat_entry['chat_id'], chat_store.count_messages(owner, chat_entry['chat_id']))
+            history = [deserialize_message(role, parts) for role, parts in stored_messages]
+            chat_entry['chat_object'] = create_chat_object(tools, history)
+        chat_entry['synced_history_len'] = len(history)
+    return chat_entry['chat_object']
+
+def delete_chat(chat_name):
+    """Deletes a chat from the session and its messages from the chat store."""
+    chat_entry = st.session_state.chat_objects.pop(chat_name)
+    get_chat_store().delete_chat(chat_owner_id(), chat_entry['chat_id'])
+    if st.session_state.selected_chat_name == chat_name:
+        st.session_state.selected_chat_name = None
+
+
+def run_async(coro):
+    """Runs a coroutine on the session's background event loop and waits for its result."""
+    event_loop = st.session_state.event_loop.loop
+    script_run_ctx = get_script_run_ctx()
+    # Run the task in the caller's contextvars context so st.* output honours
+    # the `with container:` block run_async was called from
+    caller_context = contextvars.copy_context()
+    result_future = concurrent.futures.Future()
+
+    async def run_with_script_ctx():
+        # st.* calls made from the loop thread need the calling script's context
+        add_script_run_ctx(threading.current_thread(), script_run_ctx)
+        try:
+            result_future.set_result(await coro)
+        except BaseException as e:
+            result_future.set_exception(e)
+
+    event_loop.call_soon_threadsafe(lambda: event_loop.create_task(run_with_script_ctx(), context=caller_context))
+    return result_future.result()
 
 
 # --- Helper Functions for UI and State Management ---
 
 def write_multiline_text(text:str)->str:
-    return "\n\n".join(text.splitlines())
+    """Doubles line breaks so markdown keeps them; one regex pass instead of splitting into a list and joining it."""
+    return LINE_BREAK_RE.sub("\n\n", text.rstrip("\r\n"))
+
+def dart_short_list_fallback_reason(corp_short_list_data):
+    """Returns why the DART short list forces a web search ('' if it has candidates), as stored in report_data['web_search_reason']."""
+    if isinstance(corp_short_list_data, str) and "not in the dart list" in corp_short_list_data.lower():
+        return "not in dart list"
+    if isinstance(corp_short_list_data, str) and "Error" in corp_short_list_data:
+        return "error in dart lookup"
+    if not corp_short_list_data:
+        return "not in short dart list"
+    return ""
+
+def extract_corp_code(corp_code_data):
+    """Returns the corp code of a DART company entry, or 'N/A' if there is none."""
+    if isinstance(corp_code_data, dict) and "error" not in corp_code_data:
+        return corp_code_data.get('corp_code', 'N/A')
+    return 'N/A'
+
+def show_error(message):
+    """Shows an error message with the traceback being handled in a collapsed code block, which skips markdown rendering."""
+    st.error(message)
+    st.expander("Error Details").code(traceback.format_exc(), language="python")
+
+def load_report_text(report_data):
+    """Returns the report markdown, read from disk when it was moved out of session state."""
+    report_path = report_data.get('report_path')
+    if report_path:
+        with open(report_path, "r", encoding="utf-8") as f:
+            return f.read()
+    return report_data.get('report', '')
+
+def build_im_query(template, full_name, company_data, finance_report):
+    """Fills an IM prompt template."""
+    return template.format(full_name=full_name, company_data=company_data, finance_report=finance_report)
 
 def set_report_to_display(report):
-    """Sets the report to be displayed in the main content area."""
-    st.session_state.report_to_display = report
-
-def remove_report_from_list(report_to_remove):
-    """Removes a report from the report_list in session state."""
-    st.session_state.report_list = [
-        report for report in st.session_state.report_list if report != report_to_remove
-    ]
+    """Sets the report (a report_data dict or summary, or None) to be displayed in the main content area."""
+    st.session_state.report_to_display = report['cache_key'] if report else None
+
+def remove_report_at(report_position):
+    """Removes the report at report_position from report_list in session state."""
+    report_to_remove = st.session_state.report_list[report_position]
+    del st.session_state.report_list[report_position]
+    st.session_state.report_index.pop((report_to_remove['url'], report_to_remove['language']), None)
+    st.session_state.docx_builds.pop(report_to_remove['cache_key'], None)
+    st.session_state.transient_reports.pop(report_to_remove['cache_key'], None)
     # If the removed report was currently displayed, clear the display
-    if st.session_state.report_to_display == report_to_remove:
+    if st.session_state.report_to_display == report_to_remove['cache_key']:
         st.session_state.report_to_display = None
 
+def report_slug(company_name):
+    """Returns company_name with spaces and path separators replaced by underscores, for file names."""
+    return FILENAME_UNSAFE_CHARS.sub('_', company_name)
+
+def is_transient_report(report_data):
+    """True for a web report that stands in for DART because a lookup or download failed; it is never resumed from disk."""
+    return report_data.get('web_search_reason') in TRANSIENT_WEB_SEARCH_REASONS
+
+def get_listed_report(cache_key):
+    """Returns the report_data of a report in report_list, or None if it's gone from the disk cache."""
+    report_data = st.session_state.transient_reports.get(cache_key)
+    return report_data if report_data is not None else report_store.get(cache_key)
+
+def add_report_to_list(report_data):
+    """
+    Appends a report to report_list unless one for the same url and language exists,
+    in which case (a regenerated report) the stored report behind that entry is replaced.
+    report_list is bounded, so the oldest report is dropped once it's full.
+    Only a small summary is kept in session state; the full report lives in report_store.
+    Transient reports can't be reloaded from disk once report_store evicts them, so the
+    session keeps their report_data itself until they leave report_list.
+    """
+    report_key = (report_data['url'], report_data['language'])
+    if is_transient_report(report_data):
+        st.session_state.transient_reports[report_data['cache_key']] = report_data
+    else:
+        st.session_state.transient_reports.pop(report_data['cache_key'], None)
+        report_store.put(report_data['cache_key'], report_data)
+    report_summary = st.session_state.report_index.get(report_key)
+    if report_summary is None:
+        company_name = report_data['company_data'].get('company_name', 'report')
+        report_summary = {
+            'cache_key': report_data['cache_key'],
+            'url': report_data['url'],
+            'language': report_data['language'],
+            'company_name': company_name,
+            # Sanitized once here instead of on every render of the report list
+            'slug': report_slug(company_name),
+        }
+        if len(st.session_state.report_list) == st.session_state.report_list.maxlen:
+            # The deque drops the oldest summary on append; drop its index entry with it
+            oldest = st.session_state.report_list[0]
+            st.session_state.report_index.pop((oldest['url'], oldest['language']), None)
+            st.session_state.transient_reports.pop(oldest['cache_key'], None)
+        st.session_state.report_index[report_key] = report_summary
+        st.session_state.report_list.append(report_summary)
+    # Build the DOCX download now, off the script thread, so it's ready when the report is selected
+    st.session_state.docx_builds[report_data['cache_key']] = get_docx_executor().submit(
+        report_docx_path, report_data, report_summary['slug'], report_data['language']
+    )
+
+async def cached_step(cache_key, part_name, step_function, *args, refresh=False):
+    """Runs one pipeline step, reusing its result from the disk cache when available (unless refresh is set)."""
+    if not refresh:
+        cached_result = report_cacher.resume_part(cache_key, part_name)
+        if cached_result is not None:
+            return cached_result
+    result = await step_function(*args)
+    # Error results (including an 'N/A' corp code pick) are not cached so the step is retried on the next run
+    is_error = (isinstance(result, str) and ("Error" in result or result.strip() == "N/A")) or (isinstance(result, dict) and "error" in result)
+    if not is_error:
+        report_cacher.persist_part(cache_key, part_name, result)
+    return result
+
 def navigate_to(page_name):
     """Sets the current page in session state for navigation."""
     st.session_state.current_page = page_name
@@ -98,6 +451,7 @@ def navigate_to(page_name):
 
 def markdown_to_docx(markdown_text, company_name, language="english", corp_code_data=None):
     """Convert markdown text to a Word document"""
+    from docx import Document
     doc = Document()
 
     # Add title
@@ -118,21 +472,16 @@ def markdown_to_docx(markdown_text, company_name, language="english", corp_code_
         if not line:
             continue
 
+        line_match = MARKDOWN_LINE_RE.match(line)
         # Handle headers
-        if line.startswith('# '):
-            doc.add_heading(line[2:], level=1)
-        elif line.startswith('## '):
-            doc.add_heading(line[3:], level=2)
-        elif line.startswith('### '):
-            doc.add_heading(line[4:], level=3)
-        elif line.startswith('#### '):
-            doc.add_heading(line[5:], level=4)
+        if line_match and line_match.lastgroup == 'heading':
+            doc.add_heading(line_match.group('heading'), level=len(line_match.group('hashes')))
         # Handle bullet points
-        elif line.startswith('- ') or line.startswith('* '):
-            doc.add_paragraph(line[2:], style='List Bullet')
+        elif line_match and line_match.lastgroup == 'bullet':
+            doc.add_paragraph(line_match.group('bullet'), style='List Bullet')
         # Handle numbered lists
-        elif line.startswith(('1. ', '2. ', '3. ', '4. ', '5. ', '6. ', '7. ', '8. ', '9. ')):
-            doc.add_paragraph(line[3:], style='List Number')
+        elif line_match and line_match.lastgroup == 'numbered':
+            doc.add_paragraph(line_match.group('numbered'), style='List Number')
         # Handle bold text (basic implementation)
         elif '**' in line:
             p = doc.add_paragraph()
@@ -148,6 +497,72 @@ def markdown_to_docx(markdown_text, company_name, language="english", corp_code_
 
     return doc
 
+@st.cache_resource
+def get_docx_executor():
+    """Process-wide pool that builds DOCX downloads off the script thread."""
+    return concurrent.futures.ThreadPoolExecutor(max_workers=DOCX_BUILD_WORKERS, thread_name_prefix="docx")
+
+def report_docx_path(report_data, company_name, language):
+    """
+    Returns the path of the report's DOCX download, building it into the report's cache entry on first use.
+    The document is saved straight to disk, so sessions don't keep it in their state; the download button
+    still reads the whole file into memory when it renders.
+    """
+    docx_path = report_cacher.file_path(report_data['cache_key'], REPORT_DOCX_FILE)
+    if not os.path.exists(docx_path):
+        doc = markdown_to_docx(load_report_text(report_data), company_name, language)
+        # Unique temp name: another session may be building the same document
+        tmp_path = f"{docx_path}.{uuid.uuid4().hex}.tmp"
+        doc.save(tmp_path)
+        os.replace(tmp_path, docx_path)
+    return docx_path
+
+@st.cache_data(show_spinner=False, max_entries=256)
+def _pretty_json(data):
+    """Serializes one part of a report once; keyed by the data itself, so a regenerated report is never served stale."""
+    return json.dumps(data, indent=2, ensure_ascii=False, default=str)
+
+def show_report_json(report_data, part_name):
+    """Renders report_data[part_name] as JSON without re-serializing it on every rerun."""
+    st.code(_pretty_json(report_data.get(part_name, {})), language='json')
+
+def show_report_images(images):
+    """Renders report images. Cached images are file paths, so Streamlit serves them from its media endpoint."""
+    for i, image_data in enumerate(images):
+        st.image(image_data, caption=f"Report Image {i + 1}")
+
+def _markdown_to_html(markdown_text):
+    import markdown
+    return markdown.markdown(markdown_text, extensions=["tables", "fenced_code", "sane_lists"])
+
+@st.cache_data(show_spinner=False, max_entries=64)
+def _report_html(report_markdown):
+    """Converts a report to HTML once; keyed by the markdown itself so reruns skip the frontend markdown pass."""
+    return _markdown_to_html(report_markdown)
+
+@st.cache_data(show_spinner=False, max_entries=512)
+def _chat_message_html(content):
+    """Converts a stored chat message to HTML once; cached by its text, so history re-renders skip the markdown pass."""
+    return _markdown_to_html(content)
+
+def show_report_markdown(report):
+    """Renders the report body as pre-rendered HTML."""
+    st.html(_report_html(report))
+
+def show_company_header(report_data):
+    """Renders the company information block shared by the generation flow and the report view."""
+    st.success("✅ Company information extracted successfully!")
+    st.subheader("📋 Company Information")
+    with st.expander("View Company Details", expanded=True):
+        show_report_json(report_data, 'company_data')
+
+def show_company_metrics(full_name, first_name, id_label, id_value):
+    """Renders company name, first name and ticker / corp code as one table instead of three st.metric widgets."""
+    cells = [("Company Name", full_name), ("First Name", first_name), (id_label, id_value)]
+    header = "".join(f"<th>{label}</th>" for label, _ in cells)
+    row = "".join(f"<td>{html.escape(str(value))}</td>" for _, value in cells)
+    st.markdown(f'<table style="width:100%"><tr>{header}</tr><tr>{row}</tr></table>', unsafe_allow_html=True)
+
 def display_report(report_data):
     company_data = report_data.get('company_data', {})
     if not company_data or "error" in company_data:
@@ -155,12 +570,7 @@ def display_report(report_data):
         if "raw_content" in company_data: st.expander("Raw LLM Output").write(write_multiline_text(company_data["raw_content"]))
         return
 
-    st.success("✅ Company information extracted successfully!")
-
-    # Display company data
-    st.subheader("📋 Company Information")
-    with st.expander("View Company Details", expanded=True):
-        st.json(company_data)
+    show_company_header(report_data)
 
     # Extract key information
     full_name = company_data.get('company_name', 'N/A')
@@ -171,34 +581,21 @@ def display_report(report_data):
     if selected_language.lower() == "english":
         ticker = company_data.get('ticker', 'N/A')
         # Display basic info for English/SEC
-        col1, col2, col3 = st.columns(3)
-        with col1:
-            st.metric("Company Name", full_name)
-        with col2:
-            st.metric("First Name", first_name)
-        with col3:
-            st.metric("Ticker", ticker)
+        show_company_metrics(full_name, first_name, "Ticker", ticker)
     else:
         # For Korean/DART, show corp code instead of ticker
-        corp_code_data = report_data.get('corp_code_data', {})
-        corp_code = corp_code_data.get('corp_code', 'N/A') if isinstance(corp_code_data, dict) else 'N/A'
+        corp_code = extract_corp_code(report_data.get('corp_code_data'))
 
 
         # Display basic info for Korean/DART
-        col1, col2, col3 = st.columns(3)
-        with col1:
-            st.metric("Company Name", full_name)
-        with col2:
-            st.metric("First Name", first_name)
-        with col3:
-            st.metric("Corp Code", corp_code)
+        show_company_metrics(full_name, first_name, "Corp Code", corp_code)
 
     if full_name == 'N/A':
         st.error("❌ Company name could not be determined. Cannot proceed.")
         return
 
-    st.markdown("---")
-    report = report_data.get('report', '')
+    st.divider()
+    report = load_report_text(report_data)
     images = report_data.get('images', [])
 
     # Process based on language
@@ -212,7 +609,7 @@ def display_report(report_data):
         else:
             st.success(f"✅ Found {len(filings_data.get('filings', []))} SEC filings.")
             with st.expander("View SEC Filings", expanded=False):
-                st.json(filings_data)
+                show_report_json(report_data, 'filings_data')
 
             urls = [filing['filingUrl'] for filing in filings_data['filings'] if 'filingUrl' in filing]
             if not urls:
@@ -243,11 +640,10 @@ def display_report(report_data):
             with st.expander("View Short List", expanded=False):
                 st.write(corp_short_list_data)
 
-            corp_code_data_from_report = report_data.get('corp_code_data', {}) # Renamed to avoid clash
-            if isinstance(corp_code_data_from_report, dict) and "error" not in corp_code_data_from_report and corp_code_data_from_report.get('corp_code') != 'N/A':
+            if extract_corp_code(report_data.get('corp_code_data')) != 'N/A':
                 st.success("✅ DART Corporation code generated.")
                 with st.expander("View Corporation Code Details", expanded=False): # Changed title for clarity
-                    st.json(corp_code_data_from_report)
+                    show_report_json(report_data, 'corp_code_data')
 
         if report_source == 'web':
             st.info("ℹ️ Report generated using web search.")
@@ -258,456 +654,329 @@ def display_report(report_data):
     if report:
         st.subheader(f"📈 {selected_language.capitalize()} Investment Report")
 
-        st.markdown("---")
-        st.markdown(report)
+        st.divider()
+        show_report_markdown(report)
 
     elif not ("Error" in report if isinstance(report, str) else False):
         st.info("ℹ️ Report generation did not produce output, or path was skipped.")
 
     if images:
         st.subheader("🖼️ Report Images")
-        for i, image_data in enumerate(images):
-            st.image(image_data, caption=f"Report Image {i + 1}")
-
+        # Collapsed expanders still send their content, so images are only sent once asked for
+        if st.toggle(f"Show {len(images)} report images", key=f"show_images_{report_data.get('cache_key')}"):
+            show_report_images(images)
 
-async def generate_report_flow(company_url_input, selected_language):
-    report_data = {'url': company_url_input, 'language': selected_language}
 
+@contextlib.asynccontextmanager
+async def deferred_spinner(text, delay=SPINNER_DELAY_SECONDS, slow_after=SLOW_STEP_SECONDS):
+    """
+    Shows `text` only once the wrapped step has run for `delay` seconds, so fast (e.g. cached)
+    steps don't flash a spinner. After `slow_after` seconds the message says it is taking longer.
+    """
+    placeholder = st.empty()
+    event_loop = asyncio.get_running_loop()
+    timers = [
+        event_loop.call_later(delay, lambda: placeholder.info(f"⏳ {text}")),
+        event_loop.call_later(slow_after, lambda: placeholder.info(f"⏳ {text} Taking longer than usual...")),
+    ]
     try:
-        with st.spinner("🔍 Analyzing company information..."):
-            # Assuming generate_company_information is an async function from prom_functions
-            company_data = await generate_company_information(company_url_input, selected_language)
-            # The line `report = company_data` was present; unclear if intentional or a typo.
-            # Storing company_data in report_data seems correct.
-            report_data['company_data'] = company_data
-
-        if not company_data or (isinstance(company_data, dict) and "error" in company_data):
-            error_msg = company_data.get('error', 'Unknown error') if isinstance(company_data, dict) else "Invalid company data"
-            st.error(f"❌ Failed to extract company information: {error_msg}")
-            if isinstance(company_data, dict) and "raw_content" in company_data:
-                st.expander("Raw LLM Output").write(company_data["raw_content"])
-            return # Stop further processing
-
-        st.success("✅ Company information extracted successfully!")
-
-        st.subheader("📋 Company Information")
-        with st.expander("View Company Details", expanded=True):
-            st.json(company_data)
-
-        full_name = company_data.get('company_name', 'N/A')
-        first_name = company_data.get('company_first_name', 'N/A')
-
-        if full_name == 'N/A':
-            st.error("❌ Company name could not be determined. Cannot proceed.")
-            return
-
-        if selected_language.lower() == "english":
-            ticker = company_data.get('ticker', 'N/A')
-            col1, col2, col3 = st.columns(3)
-            with col1: st.metric("Company Name", full_name)
-            with col2: st.metric("First Name", first_name)
-            with col3: st.metric("Ticker", ticker)
-        # For Korean, metrics including corp_code are shown later after corp_code generation
-
-        statement_type = st.session_state.last_statement_types
-        if statement_type:
-            finanace_report = f"Also Add {statement_type} in detail"
-        else:
-            finanace_report = ""
-
-        query_template = f"""As an investment associate, draft an information memorandum for company: {full_name}
-        Information of Company: {company_data}
-
-        -ADD These in table of contents:
-
-        These are the Headings you need to use for IM and then generate sub headings for each heading
-        1.Executive Summary
-        2.Investment Highlights
-        3.Company Overview
-            Introduction to {full_name}
-            History, Mission, and Core Values
-            Global Presence and Operations
-        4.Business Model, Strategy, and Product
-        5.Business Segments Deep Dive
-        6.Industry Overview and Competitive Positioning
-        7.Financial Performance Analysis 
-            Revenue
-            {finanace_report}
-        8.Management and Corporate Governance
-        9.Strategic Initiatives and Future Growth Drivers 
-        10.Risk Factors 
-        11.Investment Considerations
-        12.Conclusion
-        13.References (Filings Annual Report, Accurate and Authentic)
-        
-        -Add Tables: Display structured data like numbers, dates, comparisons, or lists in a table with headers, then summarize its main takeaways. For other content, use bullet points or numbered lists.
-
-        -(Please exclude SWOT analysis)
-        """
-        st.markdown("---")
-        report_content = "" # Renamed from 'report' to avoid conflict with company_data assignment earlier if it was a typo
-        images = []
-        corp_code_value = 'N/A' # Initialize for DART
-
-        if selected_language.lower() == "english":
-            st.subheader("🇺🇸 SEC Filing Analysis")
-            try:
-                with st.spinner("📄 Searching SEC filings..."):
-                    ticker = company_data.get('ticker', 'N/A') # Ensure ticker is available
-                    filings_data = await sec_search(full_name, ticker)
-                    report_data['filings_data'] = filings_data
-
-                if not filings_data or not filings_data.get('filings'):
-                    st.info("⚠️ No SEC filings found or error in fetching.")
-                    urls = []
-                else:
-                    st.success(f"✅ Found {len(filings_data.get('filings', []))} SEC filings.")
-                    with st.expander("View SEC Filings", expanded=False):
-                        st.json(filings_data)
-                    urls = [filing['filingUrl'] for filing in filings_data['filings'] if 'filingUrl' in filing]
-                    if not urls: st.warning("⚠️ No URLs found in SEC filings to generate report from.")
+        yield
+    finally:
+        for timer in timers:
+            timer.cancel()
+        placeholder.empty()
 
-                try:
-                    with st.spinner("📊 Generating comprehensive IM report..."):
-                        report_content, images, _ = await sec_get_report( # Assuming logs are not needed here
-                            query=query_template,
-                            report_type="research_report",
-                            sources=urls # Using all URLs as per new code
-                        )
-                    report_data['report'] = report_content
-                    report_data['images'] = images
-                    st.success("✅ IM report generated successfully!")
-                except Exception as sec_error:
-                    st.error(f"❌ Error generating report: {str(sec_error)}")
-                    st.expander("Error Details").write(f"Full error: {write_multiline_text(traceback.format_exc())}")
-                    return
-                    report_data['report'] = f"Error generating report: {str(sec_error)}"
-            except Exception as filing_error:
-                st.error(f"❌ Error in SEC filing process: {str(filing_error)}")
-                st.expander("Error Details").write(f"Full error: {write_multiline_text(traceback.format_exc())}")
-                return
-                report_data['report'] = f"Error in SEC filing process: {str(filing_error)}"
-
-
-        elif selected_language.lower() == "korean":
-            st.subheader("🇰🇷 DART Filing Analysis")
-            corp_code_data_for_report = {} # Initialize
-            try:
-                with st.spinner("📝 Generating company short list for DART..."):
-                    company_first_name_for_dart = first_name if first_name != 'N/A' else full_name.split(" ")[0]
-                    # Using get_dart_company_information as per new script
-                    corp_short_list_data = await get_dart_company_information(full_name, company_first_name_for_dart)
-                    report_data['corp_short_list_data'] = corp_short_list_data
-
-                use_web_search = False
-                web_search_reason = ""
-
-                if isinstance(corp_short_list_data, str) and "not in the dart list" in corp_short_list_data.lower():
-                    st.info("ℹ️ Company not in DART list. Using web search instead.")
-                    use_web_search = True
-                    web_search_reason = "not in dart list"
-                elif isinstance(corp_short_list_data, str) and "Error" in corp_short_list_data:
-                    st.info(f"ℹ️ Error in DART lookup: {corp_short_list_data}. Using web search instead.")
-                    use_web_search = True
-                    web_search_reason = "error in dart lookup"
-                elif not corp_short_list_data or (isinstance(corp_short_list_data, dict) and not corp_short_list_data):
-                    st.info("ℹ️ Company in DART list but not found in short DART list. Using web search instead.")
-                    use_web_search = True
-                    web_search_reason = "not in short dart list"
-                else: # Company found in DART short list (corp_short_list_data is likely a list of dicts)
-                    st.success("✅ Company found in DART short list.")
-                    with st.expander("View Short List", expanded=False): st.write(corp_short_list_data)
-
-                    with st.spinner("🔢 Generating DART corporation code..."):
-                        # generate_corp_code now takes company_url_input
-                        selected_corp_index_str = await generate_corp_code(full_name, corp_short_list_data, company_url_input)
-                        # st.write(selected_corp_index_str) # Original debug line
-
-                        if selected_corp_index_str != 'N/A' and selected_corp_index_str is not None:
-                            try:
-                                selected_index = int(selected_corp_index_str)
-                                if 0 <= selected_index < len(corp_short_list_data):
-                                    corp_code_data_for_report = corp_short_list_data[selected_index]
-                                    report_data['corp_code_data'] = corp_code_data_for_report
-                                    corp_code_value = corp_code_data_for_report.get('corp_code', 'N/A')
-
-                                    with st.expander("View Company Information (DART)", expanded=False):
-                                        st.write(corp_code_data_for_report)
-                                    with st.expander("View Corp Code (DART)", expanded=False):
-                                        st.write(corp_code_value)
-                                    st.success("✅ DART Corporation code processed.")
-                                else:
-                                    st.info("ℹ️ Invalid index for DART company. Using web search.")
-                                    use_web_search = True
-                                    web_search_reason = "corp code generation failed - invalid index"
-                            except ValueError:
-                                st.info("ℹ️ Corp code selection was not a valid number. Using web search.")
-                                use_web_search = True
-                                web_search_reason = "corp code generation failed - non-integer index"
-                        else: # generate_corp_code returned 'N/A' or None
-                             st.info("ℹ️ Could not determine company data in DART. Using web search instead.")
-                             if isinstance(corp_code_data_for_report, dict) and "raw_content" in corp_code_data_for_report: # Check if corp_code_data_for_report got any raw_content
-                                 st.expander("Raw LLM Output").write(corp_code_data_for_report["raw_content"])
-                             use_web_search = True
-                             web_search_reason = "corp code generation failed - N/A"
-
-                # Display metrics for Korean company after attempting corp_code generation
-                st.markdown("### 📊 Company Metrics (DART)")
-                col1_k, col2_k, col3_k = st.columns(3)
-                with col1_k: st.metric("Company Name", full_name)
-                with col2_k: st.metric("First Name", first_name)
-                with col3_k: st.metric("Corp Code", corp_code_value) # Shows N/A if not found
-
-                if use_web_search:
-                    report_source = 'web'
-                    report_data['report_source'] = report_source
-                    report_data['web_search_reason'] = web_search_reason
-                    try:
-                        with st.spinner("📊 Generating IM report using web search..."):
-                            report_content, images, _ = await dart_get_report(
-                                query=query_template, report_source=report_source, path=None
-                            )
-                        report_data['report'] = report_content
-                        report_data['images'] = images
-                        st.success("✅ Report generated using web search!")
-                    except Exception as dart_web_error:
-                        st.error(f"❌ Error generating DART report (web search): {str(dart_web_error)}")
-                        st.expander("Error Details").write(f"Full error: {write_multiline_text(traceback.format_exc())}")
-                        return
-                        report_data['report'] = f"Error generating report (web): {str(dart_web_error)}"
-                elif corp_code_value != 'N/A': # Proceed with DART documents only if corp_code was found
-                    st.info("✅ Company found in DART. Proceeding with DART filing download and report generation.")
-                    with tempfile.TemporaryDirectory() as temp_dir:
-                        try:
-                            with st.spinner("📄 Searching DART filings and downloading documents..."):
-                                doc_path = await dart_search(corp_code_value, temp_dir)
-
-                            if not doc_path:
-                                st.info("❌ Company data is not available in DART documents. Using web sources instead.")
-                                report_source = 'web' # Fallback to web
-                                report_data['report_source'] = report_source
-                                # Regenerate report with web source if docs not found
-                                with st.spinner("📊 Generating IM report using web search (fallback)..."):
-                                     report_content, images, _ = await dart_get_report(
-                                        query=query_template, report_source='web', path=None)
-                                     report_data['report'] = report_content
-                                     report_data['images'] = images
-                                     st.success("✅ Report generated using web search (fallback from no DART docs)!")
-
-                            else: # Documents found
-                                report_source = 'hybrid'
-                                report_data['report_source'] = report_source
-                                #st.success(f"✅ DART documents Saved. Path: {doc_path}")
-                                #with st.expander("View Document", expanded=False): st.write(doc_path)
-
-                                display_doc_path = os.path.relpath(doc_path, temp_dir)
-                                st.success(f"✅ DART documents processed. Path: {display_doc_path}")
-
-                                #dart_references_files=os.listdir(doc_path)
-                                #st.success(f"✅ DART documents processed. Files: {dart_references_files}")
-
-                                with st.expander("View Document Path", expanded=False): st.write(display_doc_path)
-                                #with st.expander("View download files", expanded=False):
-                                    #st.write(dart_references_files)
-                                    # for file in dart_references_files:
-                                    #     if file.endswith('.txt'):
-                                    #         file_path = os.path.join(doc_path, file)
-                                    #
-                                    #         col1, col2 = st.columns([3, 1])
-                                    #
-                                    #         with col1:
-                                    #             st.write(f"📄 {file}")
-                                    #
-                                    #         with col2:
-                                    #             with open(file_path, 'r', encoding='utf-8') as f:
-                                    #                 file_content = f.read()
-                                    #
-                                    #             st.download_button(
-                                    #                 label="⬇️",
-                                    #                 data=file_content,
-                                    #                 file_name=file,
-                                    #                 mime='text/plain',
-                                    #                 key=f"download_{file}"  # Unique key for each button
-                                    #             )
-
-                                with st.spinner("📊 Generating comprehensive IM report from DART docs..."):
-                                    report_content, images, _ = await dart_get_report(
-                                        query=query_template, report_source=report_source, path=doc_path
-                                    )
-                                report_data['report'] = report_content
-                                report_data['images'] = images
-                                st.success("✅ Success! Report generated using DART filings!")
-
-                        except Exception as dart_filing_error:
-                            st.error(f"❌ Error generating report from DART filings: {str(dart_filing_error)}")
-                            st.expander("Error Details").write(f"Full error: \n{write_multiline_text(traceback.format_exc())}")
-                            return
-                            report_data['report'] = f"Error generating report (DART filings): {str(dart_filing_error)}"
-                else: # Not using web search but corp_code_value is N/A - this case should be handled by web_search_reason
-                    st.warning("ℹ️ Could not proceed with DART document search as Corp Code was not identified.")
-                    report_data['report'] = "Could not obtain DART Corp Code for document search."
-
-
-            except Exception as dart_general_error:
-                st.error(f"❌ Error in DART filing process: {str(dart_general_error)}")
-                st.expander("Error Details").write(f"Full error: {write_multiline_text(traceback.format_exc())}")
-                return
-                report_data['report'] = f"Error in DART filing process: {str(dart_general_error)}"
-
-        st.session_state.report_to_display = report_data
-        if not any(existing_report['url'] == report_data['url'] and existing_report['language'] == report_data['language'] for existing_report in st.session_state.report_list):
-            st.session_state.report_list.append(report_data)
-        st.rerun()
+class ReportGenerationError(Exception):
+    """Raised by run_report_pipeline when no report can be generated; the message is meant for the user."""
 
-        # This image display seems redundant if display_report is called immediately after.
-        # However, if generate_report_flow is meant to update the main area directly:
-        if images:
-            st.subheader("🖼️ Report Images (from generation)")
-            for i, image_data in enumerate(images):
-                st.image(image_data, caption=f"Report Image {i + 1}")
-        # Calling display_report here if this function is responsible for the final main page update
-        # display_report(report_data) # Or rely on the main script logic to call display_report
 
+class ReportProgress():
+    """
+    Progress hooks of run_report_pipeline. This base class shows nothing and is what
+    background runs use; StreamlitReportProgress renders every step into the page.
+    """
+    def step(self, text):
+        """Returns the async context manager wrapped around a slow step."""
+        return contextlib.nullcontext()
 
-    except Exception as general_error:
-        st.error(f"❌ Unexpected error in report generation flow: {str(general_error)}")
-        st.expander("Error Details").write(f"Full error: {write_multiline_text(traceback.format_exc())}")
-        return
-        # Ensure report_data has some error message if an overarching error occurs
-        if 'report' not in report_data or not report_data['report'] :
-             report_data['report'] = f"Unexpected error in report generation: {str(general_error)}"
-        st.session_state.report_to_display = report_data # Display error info
-        # Optionally add to list for review
-        if not any(existing_report['url'] == report_data['url'] and existing_report['language'] == report_data['language'] for existing_report in st.session_state.report_list):
-            st.session_state.report_list.append(report_data)
-
-def display_report_details(report_data):
-    """Displays the comprehensive report details in the main content area."""
-    company_data = report_data.get('company_data', {})
-    if not company_data or "error" in company_data:
-        st.error(f"❌ Failed to extract company information: {company_data.get('error', 'Unknown error')}")
-        if "raw_content" in company_data:
-            st.expander("Raw LLM Output").write(company_data["raw_content"])
-        return
+    def stream_containers(self):
+        """Returns the (logs, report) containers GPTResearcher streams into, or (None, None) for no streaming."""
+        return None, None
 
-    st.success("✅ Company information extracted successfully!")
+    def message(self, kind, text):
+        """Reports the outcome of a step; kind is 'info', 'success' or 'warning'."""
 
-    # Display company data
-    st.subheader("📋 Company Information")
-    with st.expander("View Company Details", expanded=True):
-        st.json(company_data)
+    def details(self, label, value):
+        """Offers intermediate data (short list, corp code, raw LLM output) for inspection."""
 
-    full_name = company_data.get('company_name', 'N/A')
-    first_name = company_data.get('company_first_name', 'N/A')
-    ticker = company_data.get('ticker', 'N/A')
+    def report_part(self, label, report_data, part_name):
+        """Offers report_data[part_name] for inspection as JSON."""
 
-    if full_name == 'N/A':
-        st.error("❌ Company name could not be determined. Cannot proceed.")
-        return
+    def section(self, title):
+        """Called when the SEC or DART part of the pipeline starts."""
 
-    col1, col2, col3 = st.columns(3)
-    with col1:
-        st.metric("Company Name", full_name)
-    with col2:
-        st.metric("First Name", first_name)
-    with col3:
-        st.metric("Ticker", ticker)
+    def company_identified(self, report_data):
+        """Called once report_data['company_data'] is known."""
 
-    st.markdown("---")
+    def company_metrics(self, full_name, first_name, id_label, id_value, title=None):
+        """Called once the company's identifier (ticker or corp code) is known."""
 
-    selected_language = report_data.get('language', '')
-    report = report_data.get('report', '')
-    images = report_data.get('images', [])
 
-    if selected_language.lower() == "english":
-        st.subheader("🇺🇸 SEC Filing Analysis")
-        filings_data = report_data.get('filings_data', {})
+class StreamlitReportProgress(ReportProgress):
+    """Renders the pipeline's progress into the page, for reports generated in the foreground."""
+    def step(self, text):
+        return deferred_spinner(text)
 
-        if not filings_data or not filings_data.get('filings'):
-            st.warning("⚠️ No SEC filings found or error in fetching.")
-        else:
-            st.success(f"✅ Found {len(filings_data.get('filings', []))} SEC filings.")
-            with st.expander("View SEC Filings", expanded=False):
-                st.json(filings_data)
+    def stream_containers(self):
+        return report_stream_containers()
 
-    elif selected_language.lower() == "korean":
-        st.subheader("🇰🇷 DART Filing Analysis")
-        corp_short_list_data = report_data.get('corp_short_list_data', {})
-        report_source = report_data.get('report_source', 'web')
-        web_search_reason = report_data.get('web_search_reason', '')
+    def message(self, kind, text):
+        getattr(st, kind)(text)
 
-        if isinstance(corp_short_list_data, str) and "not in the dart list" in corp_short_list_data.lower():
-            st.info("ℹ️ Company not in DART list. Report generated using web search.")
-        elif web_search_reason == "not in short dart list":
-            st.info("ℹ️ Company in DART list but not found in short DART list. Report generated using web search.")
-        elif web_search_reason == "error in dart lookup":
-            st.info("ℹ️ Error in DART lookup. Report generated using web search.")
-        elif web_search_reason == "corp code generation failed":
-            st.info("ℹ️ DART corporation code generation failed. Report generated using web search.")
-        elif not corp_short_list_data:
-            st.info("ℹ️ Company not found in DART list. Report generated using web search.")
-        else:
-            st.success("✅ Company found in DART short list.")
-            with st.expander("View Short List", expanded=False):
-                st.write(corp_short_list_data)
+    def details(self, label, value):
+        with st.expander(label, expanded=False):
+            st.write(value)
 
-            corp_code_data = report_data.get('corp_code_data', {})
-            if corp_code_data and "error" not in corp_code_data and corp_code_data.get('corp_code') != 'N/A':
-                st.success("✅ DART Corporation code generated.")
-                with st.expander("View Corporation Code", expanded=False):
-                    st.json(corp_code_data)
+    def report_part(self, label, report_data, part_name):
+        with st.expander(label, expanded=False):
+            show_report_json(report_data, part_name)
 
-        if report_source == 'web':
-            st.info("ℹ️ Report generated using web search.")
-        else:
-            st.success("✅ Success! Report generated using DART filings!")
+    def section(self, title):
+        st.divider()
+        st.subheader(title)
 
-    if report_data.get('logs'):
-        with st.expander("📊 Research Logs"):
-            st.write(report_data['logs'])
+    def company_identified(self, report_data):
+        show_company_header(report_data)
+
+    def company_metrics(self, full_name, first_name, id_label, id_value, title=None):
+        if title:
+            st.markdown(f"### {title}")
+        show_company_metrics(full_name, first_name, id_label, id_value)
 
-    if report:
-        st.subheader(f"📈 {selected_language.capitalize()} Investment Report")
-        company_name_clean = full_name.replace(' ', '_').replace('/', '_').replace('\\', '_')
 
-        with st.expander("View Full Report", expanded=True):
-            st.markdown(report)
+def report_stream_containers():
+    """Creates the placeholders GPTResearcher streams its research logs and the partial report into."""
+    with st.expander('📊 Research Logs', expanded=False):
+        logs_container = st.empty()
+    report_container = st.empty()
+    return logs_container, report_container
+
+async def sec_report_steps(report_data, full_name, first_name, query_template, progress, regenerate):
+    """SEC part of run_report_pipeline. Returns (report_content, images)."""
+    from prom_functions import sec_search, sec_get_report
+    ticker = report_data['company_data'].get('ticker', 'N/A')
+    progress.company_metrics(full_name, first_name, "Ticker", ticker)
+    progress.section("🇺🇸 SEC Filing Analysis")
+
+    async with progress.step("📄 Searching SEC filings..."):
+        filings_data = await sec_search(full_name, ticker, refresh=regenerate)
+    report_data['filings_data'] = filings_data
+
+    if not filings_data or not filings_data.get('filings'):
+        progress.message("info", "⚠️ No SEC filings found or error in fetching.")
+        urls = []
     else:
-        st.info("ℹ️ Report generation did not produce output, or path was skipped.")
+        progress.message("success", f"✅ Found {len(filings_data.get('filings', []))} SEC filings.")
+        progress.report_part("View SEC Filings", report_data, 'filings_data')
+        urls = [filing['filingUrl'] for filing in filings_data['filings'] if 'filingUrl' in filing]
+        if not urls:
+            progress.message("warning", "⚠️ No URLs found in SEC filings to generate report from.")
+
+    async with progress.step("📊 Generating comprehensive IM report..."):
+        logs_container, report_container = progress.stream_containers()
+        report_content, images, _ = await sec_get_report(
+            query=query_template,
+            report_type="research_report",
+            sources=urls,
+            logs_container=logs_container,
+            report_container=report_container
+        )
+    progress.message("success", "✅ IM report generated successfully!")
+    return report_content, images
+
+async def dart_report_steps(report_data, full_name, first_name, query_template, progress, step, corp_list_prefetch, dart_cache_dir, regenerate):
+    """DART part of run_report_pipeline. Returns (report_content, images) and sets report_source / web_search_reason."""
+    from prom_functions import (
+        generate_corp_code,
+        dart_search_with_web_fallback,
+        dart_get_report_coalesced,
+        get_dart_company_information_cached
+    )
+    progress.section("🇰🇷 DART Filing Analysis")
+
+    async with progress.step("📝 Generating company short list for DART..."):
+        company_first_name_for_dart = first_name if first_name != 'N/A' else full_name.split(" ")[0]
+        await corp_list_prefetch
+        corp_short_list_data = await get_dart_company_information_cached(full_name, company_first_name_for_dart, refresh=regenerate)
+    report_data['corp_short_list_data'] = corp_short_list_data
+
+    corp_code_value = 'N/A'
+    web_search_reason = dart_short_list_fallback_reason(corp_short_list_data)
+    if web_search_reason == "not in dart list":
+        progress.message("info", "ℹ️ Company not in DART list. Using web search instead.")
+    elif web_search_reason == "error in dart lookup":
+        progress.message("info", f"ℹ️ Error in DART lookup: {corp_short_list_data}. Using web search instead.")
+    elif web_search_reason == "not in short dart list":
+        progress.message("info", "ℹ️ Company in DART list but not found in short DART list. Using web search instead.")
+    else:
+        progress.message("success", "✅ Company found in DART short list.")
+        progress.details("View Short List", corp_short_list_data)
+
+        async with progress.step("🔢 Generating DART corporation code..."):
+            selected_corp_index_str = await step("corp_code", generate_corp_code, full_name, corp_short_list_data, report_data['url'])
+        try:
+            selected_index = int(selected_corp_index_str)
+        except (TypeError, ValueError):
+            selected_index = -1
+        if 0 <= selected_index < len(corp_short_list_data):
+            report_data['corp_code_data'] = corp_short_list_data[selected_index]
+            corp_code_value = extract_corp_code(report_data['corp_code_data'])
+        if corp_code_value == 'N/A':
+            progress.message("info", "ℹ️ Could not determine company data in DART. Using web search instead.")
+            web_search_reason = "corp code generation failed"
+        else:
+            progress.details("View Company Information (DART)", report_data['corp_code_data'])
+            progress.details("View Corp Code (DART)", corp_code_value)
+            progress.message("success", "✅ DART Corporation code processed.")
+
+    progress.company_metrics(full_name, first_name, "Corp Code", corp_code_value, title="📊 Company Metrics (DART)")
+
+    if web_search_reason:
+        report_source = 'web'
+        async with progress.step("📊 Generating IM report using web search..."):
+            logs_container, report_container = progress.stream_containers()
+            report_content, images, _ = await dart_get_report_coalesced(
+                query=query_template, report_source=report_source, path=None,
+                logs_container=logs_container, report_container=report_container
+            )
+        progress.message("success", "✅ Report generated using web search!")
+    else:
+        progress.message("info", "✅ Company found in DART. Proceeding with DART filing download and report generation.")
+        # The web-only fallback research runs alongside the DART download
+        # and is cancelled as soon as DART returns documents
+        async with progress.step("📄 Searching DART filings and downloading documents..."):
+            logs_container, report_container = progress.stream_containers()
+            doc_path, web_report = await dart_search_with_web_fallback(
+                corp_code_value, dart_cache_dir, query_template,
+                logs_container=logs_container, report_container=report_container, refresh=regenerate)
+
+        if not doc_path:
+            progress.message("info", "❌ Company data is not available in DART documents. Using web sources instead.")
+            report_source = 'web'
+            web_search_reason = "no dart documents"
+            report_content, images, _ = web_report
+            progress.message("success", "✅ Report generated using web search (fallback from no DART docs)!")
+        else:
+            report_source = 'hybrid'
+            display_doc_path = os.path.relpath(doc_path, dart_cache_dir)
+            progress.message("success", f"✅ DART documents processed. Path: {display_doc_path}")
+            progress.details("View Document Path", display_doc_path)
+            async with progress.step("📊 Generating comprehensive IM report from DART docs..."):
+                report_content, images, _ = await dart_get_report_coalesced(
+                    query=query_template, report_source=report_source, path=doc_path,
+                    logs_container=logs_container, report_container=report_container
+                )
+            progress.message("success", "✅ Success! Report generated using DART filings!")
 
-    if images:
-        st.subheader("🖼️ Report Images")
-        for i, image_data in enumerate(images):
-            st.image(image_data, caption=f"Report Image {i + 1}")
+    report_data['report_source'] = report_source
+    if web_search_reason:
+        report_data['web_search_reason'] = web_search_reason
+    return report_content, images
 
-def display_welcome_message():
-    """Displays the welcome message and instructions."""
-    st.markdown("""
-    ## Welcome to the Investment Report Generator! 👋
+async def run_report_pipeline(company_url_input, selected_language, statement_types, dart_cache_dir, progress=None, regenerate=False):
+    """
+    Generates the report for (company_url_input, selected_language), or resumes it from the disk cache.
+    Shared by the foreground flow and background runs; progress gets the UI hooks (a silent ReportProgress by default).
+    dart_cache_dir is the session's DART directory, passed in since background runs are off the script thread.
+    With regenerate, the cached report and every cached lookup behind it are ignored and replaced.
+    Returns the persisted report_data and raises ReportGenerationError if no report can be generated.
+    """
+    from prom_functions import generate_company_information_cached, prefetch_dart_corp_list
+    progress = progress or ReportProgress()
+    cache_key = report_cache_key(company_url_input, selected_language)
+    if not regenerate:
+        cached_report = report_cacher.resume(cache_key)
+        if cached_report:
+            return cached_report
+    report_data = {'url': company_url_input, 'language': selected_language, 'cache_key': cache_key}
+    is_korean = selected_language.lower() == "korean"
+    # The DART corp list doesn't depend on the company, so it loads while the company is identified
+    corp_list_prefetch = asyncio.create_task(prefetch_dart_corp_list()) if is_korean else None
+
+    # Lookups shared across reports of a company (company details, SEC filings, DART short list and
+    # statements) are cached in prom_functions; only the per-report corp code pick is a disk cache part
+    async def step(part_name, step_function, *args):
+        return await cached_step(cache_key, part_name, step_function, *args, refresh=regenerate)
+
+    async with progress.step("🔍 Analyzing company information..."):
+        # Successful lookups are cached per (url, language), so resubmitting the same company skips the LLM
+        company_data = await generate_company_information_cached(company_url_input, selected_language, refresh=regenerate)
+    report_data['company_data'] = company_data
+
+    if not company_data or (isinstance(company_data, dict) and "error" in company_data):
+        error_msg = company_data.get('error', 'Unknown error') if isinstance(company_data, dict) else "Invalid company data"
+        if isinstance(company_data, dict) and "raw_content" in company_data:
+            progress.details("Raw LLM Output", company_data["raw_content"])
+        raise ReportGenerationError(f"Failed to extract company information: {error_msg}")
+
+    progress.company_identified(report_data)
+    full_name = company_data.get('company_name', 'N/A')
+    first_name = company_data.get('company_first_name', 'N/A')
+    if full_name == 'N/A':
+        raise ReportGenerationError("Company name could not be determined. Cannot proceed.")
 
-    This application helps you generate comprehensive investment reports for companies using:
+    finanace_report = f"Also Add {statement_types} in detail" if statement_types else ""
+    query_template = build_im_query(ENGLISH_IM_TEMPLATE, full_name, company_data, finanace_report)
 
-    - **SEC Filings** (for English/US companies)
-    - **DART Filings** (for Korean companies)
+    if is_korean:
+        report_content, images = await dart_report_steps(
+            report_data, full_name, first_name, query_template, progress, step, corp_list_prefetch, dart_cache_dir, regenerate)
+    else:
+        report_content, images = await sec_report_steps(report_data, full_name, first_name, query_template, progress, regenerate)
 
-    ### How to use:
-    1. Select your preferred **filings type** (Global SEC or Korean DART) above.
-    2. Enter the **company's website URL** in the input field.
-    3. Click "**🚀 Generate Report**" to start the analysis.
+    if not report_content:
+        raise ReportGenerationError("The research run did not produce a report.")
+    report_data['report'] = report_content
+    report_data['images'] = images
+    # A web report that stands in for DART because a lookup or download failed is kept for this
+    # session only (never resumed), so the next run tries DART again
+    ttl_seconds = 0 if is_transient_report(report_data) else None
+    return report_cacher.persist(cache_key, report_data, ttl_seconds=ttl_seconds)
 
-    ### Features:
-    - 🔍 Automatic company information extraction
-    - 📄 Filing search and analysis
-    - 📊 Comprehensive investment memorandum generation
-    - 🖼️ Visual report elements (if generated)
-    - 📥 Download reports as markdown files
+async def generate_report_flow(company_url_input, selected_language, regenerate=False):
+    """Generates (or resumes) the report with its progress shown in the page and adds it to session state. Returns True once it is there."""
+    try:
+        report_data = await run_report_pipeline(
+            company_url_input, selected_language, st.session_state.last_statement_types,
+            st.session_state.dart_cache_dir, progress=StreamlitReportProgress(), regenerate=regenerate
+        )
+    except ReportGenerationError as e:
+        st.error(f"❌ {e}")
+        return False
+    except Exception as e:
+        show_error(f"❌ Unexpected error in report generation flow: {str(e)}")
+        return False
+    add_report_to_list(report_data)
+    set_report_to_display(report_data)
+    # No st.rerun(): the report list below renders the new report in this same run
+    return True
 
-    **Get started by filling out the details above!**
-    """)
+def display_welcome_message():
+    """Displays the welcome message and instructions."""
+    st.markdown(WELCOME_MD)
 
 
 # --- Helper Functions for Agent Logic ---
 
+@st.cache_resource(show_spinner=False)
+def build_chat_tools(file_hash, _file_path, _client):
+    """
+    Builds the chat tools for a document. Keyed by content hash so identical uploads are embedded only once;
+    the hash ends with the file extension, so the same bytes loaded as another type are cached separately.
+    """
+    from load_files import process_files_and_get_chat_object
+    return process_files_and_get_chat_object(file_path_list=[_file_path], client=_client)
+
 def process_uploaded_file(uploaded_file):
     """
     Processes the uploaded file (e.g., extracts text, creates embeddings)
@@ -715,21 +984,35 @@ def process_uploaded_file(uploaded_file):
     Returns a dictionary containing file info and the chat object.
     """
     if uploaded_file:
-        file_extension = os.path.splitext(uploaded_file.name)[1]
-        with tempfile.NamedTemporaryFile(delete=False, suffix=file_extension) as tmp_file:
-            tmp_file.write(uploaded_file.getvalue())
-            file_path = tmp_file.name
-            tools_list = process_files_and_get_chat_object(file_path_list=[file_path], client=st.session_state.google_client)
+        if uploaded_file.size > MAX_UPLOAD_BYTES:
+            st.error(f"'{uploaded_file.name}' is larger than the {MAX_UPLOAD_BYTES // (1024 * 1024)} MB upload limit.")
+            return None
+        file_extension = os.path.splitext(uploaded_file.name)[1].lower()
+        # getbuffer() is a view on the upload, so hashing doesn't copy it. The extension picks the loader,
+        # so it is part of the id: the same bytes under another extension are a different document
+        file_hash = hashlib.blake2b(uploaded_file.getbuffer(), digest_size=16).hexdigest() + file_extension
+        # The same content this session uploaded before (under any name with the same extension) reuses its temp file,
+        # and any session uploading it reuses the cached tools
+        file_path = get_chat_store().file_path(chat_owner_id(), file_hash)
+        if file_path is None:
+            with tempfile.NamedTemporaryFile(delete=False, suffix=file_extension) as tmp_file:
+                # Copy in 1 MB chunks instead of materializing the whole upload with getvalue()
+                uploaded_file.seek(0)
+                shutil.copyfileobj(uploaded_file, tmp_file, length=UPLOAD_COPY_CHUNK_BYTES)
+                file_path = tmp_file.name
+        tools_list = build_chat_tools(file_hash, file_path, get_google_client())
+        get_chat_store().record_file(chat_owner_id(), file_hash, uploaded_file.name, file_path)
         st.success(f"Document '{uploaded_file.name}' processed and ready for chat.")
-        return {"name": uploaded_file.name, "path": file_path, "id": os.path.basename(file_path), 'tools_list': tools_list}
+        return {"name": uploaded_file.name, "path": file_path, "id": file_hash, 'tools_list': tools_list}
     return None
 
-def create_chat_object(tools_list):
-    client = st.session_state.google_client
+def create_chat_object(tools_list, history=None):
+    from google.genai import types
+    client = get_google_client()
     config = types.GenerateContentConfig(
         tools=tools_list
     )
-    chat_object = client.chats.create(model=os.getenv("GEMINI_MODEL_NAME"),config=config)
+    chat_object = client.chats.create(model=os.getenv("GEMINI_MODEL_NAME"),config=config,history=history)
     return chat_object
 
 
@@ -747,7 +1030,7 @@ def render_report_generator_page():
     st.title("📊IM Draft Generator")
     st.markdown("Generate comprehensive investment reports for companies using SEC or DART filings")
 
-    st.markdown("---")
+    st.divider()
 
     # --- Section: Generate New Report ---
     st.header("✨ Generate New Report")
@@ -790,100 +1073,258 @@ def render_report_generator_page():
                 st.session_state.last_statement_types = statement_types
 
         generate_button = st.button("🚀 Generate Report", type="primary")
+        run_in_background = st.checkbox(
+            "Run in background",
+            help="Generate without blocking the page. Progress isn't streamed; the report is added to the list when it's done."
+        )
+        regenerate = st.checkbox(
+            "Regenerate",
+            help="Ignore the cached report for this company and language, look up its company details, filings and DART statements again and regenerate it."
+        )
 
     if generate_button:
         if not company_url:
             st.warning("⚠️ Please enter a company URL to generate the report.")
         else:
-            is_duplicate = any(
-                r["url"] == company_url and r["language"] == language
-                for r in st.session_state.report_list
-            )
-            if is_duplicate:
-                st.info("⚠️ A report for this company and language has already been generated. Displaying the existing report.")
-                existing_report = next(
-                    (r for r in st.session_state.report_list if r["url"] == company_url and r["language"] == language),
-                    None
-                )
-                if existing_report:
-                    set_report_to_display(existing_report)
+            existing_report = st.session_state.report_index.get((company_url, language))
+            if existing_report and not regenerate:
+                st.info("⚠️ A report for this company and language has already been generated. Displaying the existing report; tick Regenerate to generate it again.")
+                set_report_to_display(existing_report)
+            elif (company_url, language) in st.session_state.background_reports:
+                st.info("⏳ This report is already being generated in the background.")
+            elif run_in_background:
+                start_background_report(company_url, language, st.session_state.last_statement_types, regenerate)
             else:
                 try:
-                    asyncio.run(generate_report_flow(company_url, language))
+                    progress_placeholder = st.empty()
+                    with progress_placeholder.container():
+                        report_ready = run_async(generate_report_flow(company_url, language, regenerate))
+                    if report_ready:
+                        # The progress output is superseded by the report details shown below
+                        progress_placeholder.empty()
                 except Exception as e:
                     st.error(f"❌ An unexpected error occurred during report generation: {str(e)}")
                     st.exception(e)
 
-    st.markdown("---")
+    if st.session_state.background_reports:
+        render_background_reports()
+    for error in st.session_state.background_report_errors:
+        st.error(f"❌ Background report failed: {error}")
+    if st.session_state.background_report_errors:
+        st.button("Dismiss errors", on_click=st.session_state.background_report_errors.clear)
 
+    st.divider()
+
+    render_generated_reports(show_welcome=not generate_button)
+
+def start_background_report(company_url, language, statement_types, regenerate=False):
+    """Starts run_report_pipeline, without progress output, on the session's event loop without waiting for it."""
+    future = asyncio.run_coroutine_threadsafe(
+        run_report_pipeline(company_url, language, statement_types, st.session_state.dart_cache_dir, regenerate=regenerate),
+        st.session_state.event_loop.loop
+    )
+    st.session_state.background_reports[(company_url, language)] = future
+
+@st.fragment(run_every=BACKGROUND_POLL_SECONDS)
+def render_background_reports():
+    """Polls the background report runs and moves finished ones into the report list."""
+    finished = False
+    for (company_url, language), future in list(st.session_state.background_reports.items()):
+        if not future.done():
+            st.info(f"⏳ Generating the {language} report for {company_url} in the background...")
+            continue
+        del st.session_state.background_reports[(company_url, language)]
+        finished = True
+        try:
+            add_report_to_list(future.result())
+        except Exception as e:
+            st.session_state.background_report_errors.append(f"{company_url} ({language}): {e}")
+    if finished:
+        # The report list lives in another fragment, so refresh the whole page once
+        st.rerun()
+
+@st.fragment
+def render_generated_reports(show_welcome):
+    """
+    Renders the generated reports list and the current report details.
+    Runs as a fragment so clicks on View / Download / Remove only rerun this section.
+    """
     # --- Section: Generated Reports ---
     st.header("📄 Generated Reports")
     if not st.session_state.report_list:
         st.info("No reports generated yet. Use the section above to create one!")
     else:
-        for i, report_data in enumerate(st.session_state.report_list):
-            col1,col2, col3,col4 = st.columns([3,1,1,1])
-            with col1:
-                company_full_name = report_data['company_data']['company_name'].replace(' ', '_').replace('/', '_').replace('\\', '_')
-                st.button(
-                    f"View {company_full_name}_{report_data['language']} Report",
-                    on_click=set_report_to_display,
-                    args=(report_data,),
-                    key=f"view_report_{i}",
-                    type="primary",
-                    use_container_width=True
-                )
-            with col2:
-                company_full_name = report_data['company_data']['company_name'].replace(' ', '_').replace('/', '_').replace('\\', '_')
-                filename = f"{company_full_name}_{report_data['language']}_report.md"
-                st.download_button(
-                    label="📥 Download MD",
-                    key=f"download_report_{i}",
-                    data=report_data['report'],
-                    file_name=filename,
-                    mime="text/markdown",
-                    use_container_width=True
-                )
-            with col3:
-                company_full_name = report_data['company_data']['company_name'].replace(' ', '_').replace('/', '_').replace('\\', '_')
-                report_text = report_data['report']
-                selected_language = report_data['language']
-                corp_code_data = report_data.get('corp_code_data', {}) if selected_language.lower() == "korean" else None
-                doc = markdown_to_docx(report_text, company_full_name, selected_language, corp_code_data)
-
-                # Save to bytes
-                doc_buffer = io.BytesIO()
-                doc.save(doc_buffer)
-                doc_buffer.seek(0)
-
-                filename_docx = f"{company_full_name}_{selected_language}_report.docx"
-                st.download_button(
-                    label="📄 Download DOCX",
-                    data=doc_buffer.getvalue(),
-                    file_name=filename_docx,
-                    mime="application/vnd.openxmlformats-officedocument.wordprocessingml.document",
-                    type="secondary",
-                    use_container_width=True
-                )
+        # One table with row selection instead of a row of widgets per report.
+        # Rows are passed as plain dicts, so app.py doesn't import pandas at startup
+        report_rows = [
+            {'name': r['company_name'], 'language': r['language'], 'url': r['url']}
+            for r in st.session_state.report_list
+        ]
+        selection_event = st.dataframe(
+            report_rows,
+            key="report_table",
+            on_select="rerun",
+            selection_mode="single-row",
+            hide_index=True,
+            use_container_width=True
+        )
+        # The selection can point past the end right after a report is removed
+        selected_rows = [row for row in selection_event.selection.rows if row < len(st.session_state.report_list)]
+        if not selected_rows:
+            st.caption("Select a report in the table to view, download or remove it.")
+        else:
+            report_summary = st.session_state.report_list[selected_rows[0]]
+            company_full_name = report_summary['slug']
+            selected_language = report_summary['language']
+            report_data = get_listed_report(report_summary['cache_key'])
+            col1, col2, col3, col4 = st.columns([3,1,1,1])
+            if report_data is None:
+                with col1:
+                    st.warning("This report is no longer in the cache. Remove it and generate it again.")
+            else:
+                with col1:
+                    st.button(
+                        f"View {company_full_name}_{selected_language} Report",
+                        on_click=set_report_to_display,
+                        args=(report_data,),
+                        key="view_report",
+                        type="primary",
+                        use_container_width=True
+                    )
+                with col2:
+                    filename = f"{company_full_name}_{selected_language}_report.md"
+                    if report_data.get('report_path'):
+                        # Read from disk when the button renders, so the markdown isn't pinned in session state.
+                        # Streamlit still reads the whole file into memory for the download
+                        with open(report_data['report_path'], "rb") as report_file:
+                            st.download_button(
+                                label="📥 Download MD",
+                                key="download_report",
+                                data=report_file,
+                                file_name=filename,
+                                mime="text/markdown",
+                                use_container_width=True
+                            )
+                    else:
+                        st.download_button(
+                            label="📥 Download MD",
+                            key="download_report",
+                            data=report_data['report'],
+                            file_name=filename,
+                            mime="text/markdown",
+                            use_container_width=True
+                        )
+                with col3:
+                    docx_build = st.session_state.docx_builds.pop(report_summary['cache_key'], None)
+                    if docx_build is not None:
+                        # Started when the report was added; wait for it instead of building the document twice.
+                        # If it failed, report_docx_path below retries and raises here
+                        concurrent.futures.wait([docx_build])
+                    docx_path = report_docx_path(report_data, company_full_name, selected_language)
+
+                    filename_docx = f"{company_full_name}_{selected_language}_report.docx"
+                    with open(docx_path, "rb") as docx_file:
+                        st.download_button(
+                            label="📄 Download DOCX",
+                            key="download_report_docx",
+                            data=docx_file,
+                            file_name=filename_docx,
+                            mime="application/vnd.openxmlformats-officedocument.wordprocessingml.document",
+                            type="secondary",
+                            use_container_width=True
+                        )
             with col4:
                 st.button(
                     "❌ Remove",
-                    on_click=remove_report_from_list,
-                    args=(report_data,),
-                    key=f"delete_report_{i}",
+                    on_click=remove_report_at,
+                    args=(selected_rows[0],),
+                    key="delete_report",
                     use_container_width=True
                 )
-    st.markdown("---")
+    st.divider()
 
-    if st.session_state.report_to_display:
+    report_to_display = get_listed_report(st.session_state.report_to_display) if st.session_state.report_to_display else None
+    if report_to_display:
         st.header("📊 Current Report Details")
-        display_report(st.session_state.report_to_display)
-        if st.button("Clear Report Display", help="Click to hide the currently displayed report details."):
-            set_report_to_display(None)
-    elif not generate_button and not st.session_state.report_to_display:
+        display_report(report_to_display)
+        st.button("Clear Report Display", help="Click to hide the currently displayed report details.", on_click=set_report_to_display, args=(None,))
+    elif show_welcome:
         display_welcome_message()
 
+def render_chat_message(role, parts):
+    """Renders one stored chat turn: its text as a chat bubble, its tool calls and results as expanders."""
+    for part in json.loads(parts):
+        if "text" in part:
+            with st.chat_message('ai' if role == 'model' else role):
+                st.html(_chat_message_html(part['text']))
+        elif "function_call" in part:
+            function_call = part['function_call']
+            with st.expander(f"⚙️ Tool Call: {function_call['name']}", expanded=False):
+                st.json(function_call['args'])
+        elif "function_response" in part:
+            function_response = part['function_response']
+            with st.expander(f"✅ Tool Result for {function_response['name']}", expanded=False):
+                st.json(function_response['response'])
+
+def sync_chat_history(chat_entry):
+    """Writes the messages the chat gained since the last sync to the chat store."""
+    chat_history = chat_entry['chat_object'].get_history()
+    new_turns = serialize_history(chat_history[chat_entry['synced_history_len']:])
+    get_chat_store().append_messages(chat_owner_id(), chat_entry['chat_id'], new_turns)
+    chat_entry['synced_history_len'] = len(chat_history)
+    chat_entry['recent_messages'] = None
+
+def stream_chat_answer(chat_object, user_query):
+    """Yields the answer text as it streams in, with a short note whenever the model calls a tool."""
+    for chunk in chat_object.send_message_stream(user_query):
+        if not chunk.candidates or not chunk.candidates[0].content or not chunk.candidates[0].content.parts:
+            continue
+        for part in chunk.candidates[0].content.parts:
+            if part.text:
+                yield part.text
+            elif part.function_call:
+                yield f"\n\n⚙️ *Calling {part.function_call.name}...*\n\n"
+
+@st.fragment
+def render_chat_panel():
+    """Renders the selected chat's history and input. Runs as a fragment so sending a message doesn't rerun the page."""
+    if st.session_state.selected_chat_name:
+        chat_entry = st.session_state.chat_objects[st.session_state.selected_chat_name]
+        current_chat = open_chat(chat_entry)
+        tools_used = chat_entry['tool_names']
+        chat_store = get_chat_store()
+
+        # Display chat history for the selected chat
+        new_line_string = "\n\n"
+        tools_name_string = ", ".join(tools_used)
+        st.subheader(f"Chat with {st.session_state.selected_chat_name}{new_line_string}{tools_name_string}")
+
+        # Only the last render_limit messages are loaded, and kept in memory until the next send
+        if chat_entry['recent_messages'] is None:
+            chat_entry['recent_messages'] = chat_store.load_messages(chat_owner_id(), chat_entry['chat_id'], chat_entry['render_limit'])
+            chat_entry['total_messages'] = chat_store.count_messages(chat_owner_id(), chat_entry['chat_id'])
+        if chat_entry['total_messages'] > len(chat_entry['recent_messages']):
+            if st.button("Show earlier messages", key="chat_show_earlier"):
+                chat_entry['render_limit'] += CHAT_HISTORY_WINDOW
+                chat_entry['recent_messages'] = None
+                st.rerun(scope="fragment")
+        for role, parts in chat_entry['recent_messages']:
+            render_chat_message(role, parts)
+
+        user_query = st.chat_input(f"Ask your query to '{st.session_state.selected_chat_name}':", key="chat_input_combined")
+        if user_query:
+            with st.chat_message("user"):
+                st.write(user_query)
+            with st.chat_message("ai"):
+                answer = st.write_stream(stream_chat_answer(current_chat, user_query))
+                if not answer:
+                    st.write("Failed to get an answer from this chat.")
+            sync_chat_history(chat_entry)
+    else:
+        st.info("Please select or create a chat object to start chatting.")
+
 def combined_tools_chat_page():
+    init_chat_tools_state()
     st.markdown("Upload a document and chat with its content using available tools.")
 
     st.subheader("Upload Document")
@@ -893,22 +1334,26 @@ def combined_tools_chat_page():
         key="file_uploader_combined"
     )
     if uploaded_file:
-        existing_file_names = [file['name'] for file in st.session_state.uploaded_files]
-        if uploaded_file.name not in existing_file_names:
+        if uploaded_file.name not in st.session_state.uploaded_files_by_name:
             with st.spinner(f"Processing {uploaded_file.name}..."):
                 processed_info = process_uploaded_file(uploaded_file)
                 if processed_info:
                     st.session_state.uploaded_files.append(processed_info)
+                    st.session_state.uploaded_files_by_name[processed_info['name']] = processed_info
                 else:
                     st.error("Failed to process document.")
         else:
             st.info(f"Document '{uploaded_file.name}' is already uploaded and processed.")
+    if st.button("🗑️ Clear processed documents cache", help="Forget cached embeddings so the next upload is processed from scratch."):
+        build_chat_tools.clear()
+        st.success("Processed documents cache cleared.")
 
     st.subheader("Create and Select Chat")
 
-    # Prepare tool options for multiselect
+    # Prepare tool options for multiselect. uploaded_files_by_name already holds the built-in tools,
+    # and dict.fromkeys dedupes while keeping upload order, so the options don't reshuffle between reruns
     default_tool_names = ["Web Search Tool", "SEC Filings Search Tool"]
-    available_tool_options = list(set(default_tool_names + [file['name'] for file in st.session_state.uploaded_files]))
+    available_tool_options = list(dict.fromkeys(default_tool_names + list(st.session_state.uploaded_files_by_name)))
 
     # Determine default selections: all available tools
     current_selection = available_tool_options
@@ -929,16 +1374,22 @@ def combined_tools_chat_page():
         else:
             # Collect the actual tool objects based on selected names
             tools_for_chat = []
+            tool_ids = []
             tool_names = []
             # Add tools from uploaded files
-            for file_info in st.session_state.uploaded_files:
-                if file_info['name'] in selected_tools_names:
+            for tool_name in selected_tools_names:
+                file_info = st.session_state.uploaded_files_by_name.get(tool_name)
+                if file_info:
+                    tool_ids.append(file_info['id'])
                     tool_names.append(file_info['name'])
-                    tools_for_chat.extend(file_info['tools_list'])
+                    tools_for_chat.extend(get_file_tools(file_info))
 
             if tools_for_chat:
                 new_chat_object = create_chat_object(tools_for_chat)
-                st.session_state.chat_objects[chat_name_input] = {'chat_object':new_chat_object, 'tool_names':tool_names}
+                chat_id = uuid.uuid4().hex
+                # Stored with its documents so the chat can be rebuilt after a restart
+                get_chat_store().record_chat(chat_owner_id(), chat_id, chat_name_input, tool_ids)
+                st.session_state.chat_objects[chat_name_input] = new_chat_entry(chat_id, tool_ids, tool_names, new_chat_object)
                 st.session_state.selected_chat_name = chat_name_input # Automatically select the new chat
                 st.success(f"Chat '{chat_name_input}' created successfully!")
                 st.rerun() # Rerun to update the chat selection dropdown
@@ -963,260 +1414,34 @@ def combined_tools_chat_page():
             )
             if selected_chat_name_from_dropdown:
                 st.session_state.selected_chat_name = selected_chat_name_from_dropdown
+                st.button("🗑️ Delete chat", key="delete_chat", on_click=delete_chat, args=(selected_chat_name_from_dropdown,),
+                          help="Delete this chat and its stored messages.")
         else:
             st.info("No chat objects available. Please create one.")
 
     with col2:
-        if st.session_state.selected_chat_name:
-            current_chat = st.session_state.chat_objects[st.session_state.selected_chat_name]['chat_object']
-            tools_used = st.session_state.chat_objects[st.session_state.selected_chat_name]['tool_names']
-
-            # Display chat history for the selected chat
-            new_line_string = "\n\n"
-            tools_name_string = ", ".join(tools_used)
-            st.subheader(f"Chat with {st.session_state.selected_chat_name}{new_line_string}{tools_name_string}")
-            chat_history = current_chat.get_history()
-            for message in chat_history:
-                message_role = message.role
-                if message_role == 'model':
-                    message_role = 'ai'
-                text_message = message.parts[0].text
-                if text_message:
-                    with st.chat_message(message_role):
-                        st.write(text_message)
-                function_call_message = message.parts[0].function_call
-                if function_call_message:
-                    function_call_name = function_call_message.name
-                    function_call_args = function_call_message.args
-                    with st.expander(f"⚙️ Tool Call: {function_call_name}", expanded=False):
-                        st.json(function_call_args)
-                function_response_message = message.parts[0].function_response
-                if function_response_message:
-                    function_response_name = function_response_message.name
-                    function_response_result = function_response_message.response
-                    with st.expander(f"✅ Tool Result for {function_response_name}", expanded=False):
-                        st.json(function_response_result)
-
-
-
-            user_query = st.chat_input(f"Ask your query to '{st.session_state.selected_chat_name}':", key="chat_input_combined")
-            if user_query:
-                with st.spinner("Getting answer..."):
-                    answer = current_chat.send_message(user_query)
-                if not answer:
-                    answer = "Failed to get an answer from this chat."
-                st.rerun() # Rerun to display the new message
-        else:
-            st.info("Please select or create a chat object to start chatting.")
-
-# --- Core Report Generation Logic (Unchanged) ---
-
-async def generate_report_flow_async(company_url_input, selected_language):
-    """
-    Handles the asynchronous flow of generating an investment report.
-    Fetches company info, then proceeds with SEC or DART filings.
-    """
-    report_data = {'url': company_url_input, 'language': selected_language}
-    st.session_state.report_to_display = None # Clear previous display during generation
-
-    # Step 1: Generate company information
-    with st.spinner("🔍 Analyzing company information..."):
-        company_data = await generate_company_information(company_url_input, selected_language)
-        report_data['company_data'] = company_data
-
-    if not company_data or "error" in company_data:
-        st.error(f"❌ Failed to extract company information: {company_data.get('error', 'Unknown error')}")
-        if "raw_content" in company_data:
-            st.expander("Raw LLM Output").write(company_data["raw_content"])
-        return
-
-    st.success("✅ Company information extracted successfully!")
-
-    full_name = company_data.get('company_name', 'N/A')
-    first_name = company_data.get('company_first_name', 'N/A')
-
-    if full_name == 'N/A':
-        st.error("❌ Company name could not be determined. Cannot proceed.")
-        return
-
-    statement_type = st.session_state.last_statement_types
-    if statement_type:
-        finanace_report = f"Also Add {statement_type} in detail"
-    else:
-        finanace_report = ""
-
-    english_query_template = f"""As an investment associate, draft an information memorandum for company: {full_name}
-    Information of Company: {company_data}
-    ADD These in table of contents:
-
-    These are the Headings you need to use for IM and then generate sub headings for each heading
-    1.Executive Summary
-    2.Investment Highlights
-    3.Company Overview
-        Introduction to {full_name}
-        History, Mission, and Core Values
-        Global Presence and Operations
-    4.Business Model, Strategy, and Product
-    5.Business Segments Deep Dive
-    6.Industry Overview and Competitive Positioning
-    7.Financial Performance Analysis
-        Revenue
-        {finanace_report}
-    8.Management and Corporate Governance
-    9.Strategic Initiatives and Future Growth Drivers
-    10.Risk Factors
-    11.Investment Considerations
-    12.Conclusion
-    13.References (Annual Report filing,Accurate and Authentic)
-    """
-
-    korean_query_template = f"""투자 담당자로서 회사 {full_name}에 대한 정보 메모를 작성하십시오.
-    회사 정보: {company_data}
-    목차에 다음 내용을 추가하십시오.
-
-    정보 메모에 사용해야 하는 제목은 다음과 같으며, 각 제목에 대한 하위 제목을 생성해야 합니다.
-    1. 요약
-    2. 투자 주요 내용
-    3. 회사 개요
-    {full_name} 소개
-    연혁, 사명 및 핵심 가치
-    글로벌 입지 및 운영
-    4. 비즈니스 모델, 전략 및 제품
-    5. 사업 부문 심층 분석
-    6. 산업 개요 및 경쟁적 포지셔닝
-    7. 재무 성과 분석
-        수익
-        {finanace_report}
-    8. 경영진 및 기업 지배구조
-    9. 전략적 이니셔티브 및 미래 성장 동력
-    10. 위험 요소
-    11. 투자 고려 사항
-    12. 결론
-    13. 참고문헌(연간 보고서 제출, 정확하고 진실함)
-    """
-    report = ""
-    images = []
-    logs = ""
-
-    with st.expander('📊 Research Logs', expanded=True):
-        logs_container = st.empty()
-        logs_container.info("Logs will appear here as the research progresses...")
-    reports_container = st.empty()
-    reports_container.info("The final report will be displayed here once generated.")
-
-    if selected_language.lower() == "english":
-        st.info("Searching SEC filings...")
-        with st.spinner("📄 Searching SEC filings..."):
-            filings_data = await sec_search(full_name)
-            report_data['filings_data'] = filings_data
-
-        if not filings_data or not filings_data.get('filings'):
-            st.warning("⚠️ No SEC filings found or error in fetching.")
-            urls = []
-        else:
-            st.success(f"✅ Found {len(filings_data.get('filings', []))} SEC filings.")
-            urls = [filing['filingUrl'] for filing in filings_data['filings'] if 'filingUrl' in filing]
-            if not urls:
-                st.warning("⚠️ No URLs found in SEC filings to generate report from.")
-
-        with st.spinner("📊 Generating comprehensive SEC report..."):
-            report, images, logs = await sec_get_report(
-                query=english_query_template,
-                report_type="research_report",
-                sources=urls[:2],
-                logs_container=logs_container,
-                report_container=reports_container
-            )
-        st.success("✅ SEC report generation complete!")
-
-    elif selected_language.lower() == "korean":
-        st.info("Initiating DART filing analysis...")
-        use_web_search = False
-        web_search_reason = ""
-        corp_code_value = None
-
-        with st.spinner("📝 Generating company short list for DART..."):
-            company_first_name_for_dart = first_name if first_name != 'N/A' else full_name.split(" ")[0]
-            corp_short_list_data = await short_list(full_name, company_first_name_for_dart)
-            report_data['corp_short_list_data'] = corp_short_list_data
-
-        if isinstance(corp_short_list_data, str) and "not in the dart list" in corp_short_list_data.lower():
-            st.info("ℹ️ Company not in DART list. Using web search instead.")
-            use_web_search = True
-            web_search_reason = "not in dart list"
-        elif isinstance(corp_short_list_data, str) and "Error" in corp_short_list_data:
-            st.info(f"ℹ️ Error in DART lookup: {corp_short_list_data}. Using web search instead.")
-            use_web_search = True
-            web_search_reason = "error in dart lookup"
-        elif not corp_short_list_data:
-            st.info("ℹ️ Company in DART list but not found in short DART list. Using web search instead.")
-            use_web_search = True
-            web_search_reason = "not in short dart list"
-        else:
-            st.success("✅ Company found in DART short list.")
-            with st.spinner("🔢 Generating DART corporation code..."):
-                corp_code_data = await generate_corp_code(full_name, corp_short_list_data)
-                report_data['corp_code_data'] = corp_code_data
-
-            if not corp_code_data or "error" in corp_code_data or corp_code_data.get('corp_code') == 'N/A':
-                st.info("ℹ️ Could not find company data in DART. Using web search instead.")
-                if "raw_content" in corp_code_data:
-                    st.expander("Raw LLM Output").write(corp_code_data["raw_content"])
-                use_web_search = True
-                web_search_reason = "corp code generation failed"
-            else:
-                st.success("✅ DART Corporation code generated.")
-                corp_code_value = corp_code_data['corp_code']
-
-        report_source = 'web' if use_web_search else 'hybrid'
-        report_data['report_source'] = report_source
-        report_data['web_search_reason'] = web_search_reason
-
-        doc_path = None
-        if not use_web_search:
-            with tempfile.TemporaryDirectory() as temp_dir:
-                with st.spinner("📄 Searching DART filings and downloading documents..."):
-                    doc_path = await dart_search(corp_code_value, temp_dir)
-
-                if not doc_path:
-                    st.info("❌ Company data is not available in DART documents. Using web sources instead.")
-                    report_source = 'web'
-                    report_data['report_source'] = report_source
-                else:
-                    st.success(f"✅ DART documents processed.")
-
-        with st.spinner(f"📊 Generating comprehensive DART report using {report_source} sources..."):
-            report, images, logs = await dart_get_report(
-                query=korean_query_template,
-                report_source=report_source,
-                path=doc_path,
-                logs_container=logs_container,
-                report_container=reports_container
-            )
-        st.success("✅ DART report generation complete!")
-
-    report_data['report'] = report
-    report_data['images'] = images
-    report_data['logs'] = logs
-
-    st.session_state.report_list.append(report_data)
-    st.session_state.report_to_display = report_data
-    st.rerun()
-
+        render_chat_panel()
 
 # --- Main Application Runner ---
 #Comment tool part
+# Page name -> renderer. Page-specific heavy modules are imported inside the renderers,
+# so only the page being viewed pays for them.
+PAGE_RENDERERS = {
+    PAGE_REPORT_GENERATOR: render_report_generator_page,
+    PAGE_COMBINED_CHAT: combined_tools_chat_page,
+}
+
 def main():
     """Main function to run the Streamlit application."""
     setup_page_config()
-    init_session_state()
+    # Session defaults only need to be filled once per session
+    if not st.session_state.get('_session_initialized'):
+        init_session_state()
+        st.session_state._session_initialized = True
 
     render_sidebar_navigation()
 
-    if st.session_state.current_page == PAGE_REPORT_GENERATOR:
-        render_report_generator_page()
-    elif st.session_state.current_page == PAGE_COMBINED_CHAT:
-        combined_tools_chat_page()
+    PAGE_RENDERERS.get(st.session_state.current_page, render_report_generator_page)()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
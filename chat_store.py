@@ -0,0 +1,203 @@
+import json
+import os
+import sqlite3
+import threading
+
+import streamlit as st
+
+CHAT_DB_PATH = os.path.join(".cache", "chat_store.sqlite3")
+
+# Bumped whenever the tables change shape; older tables are dropped and recreated
+_SCHEMA_VERSION = 2
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    owner TEXT NOT NULL,
+    id TEXT NOT NULL,
+    name TEXT NOT NULL,
+    path TEXT NOT NULL,
+    PRIMARY KEY (owner, id)
+);
+CREATE TABLE IF NOT EXISTS chats (
+    chat_id TEXT NOT NULL,
+    idx INTEGER NOT NULL,
+    role TEXT NOT NULL,
+    parts TEXT NOT NULL,
+    PRIMARY KEY (chat_id, idx)
+);
+CREATE TABLE IF NOT EXISTS chat_sessions (
+    chat_id TEXT PRIMARY KEY,
+    owner TEXT NOT NULL,
+    name TEXT NOT NULL,
+    tool_ids TEXT NOT NULL
+);
+"""
+
+
+class ChatStore():
+    """
+    SQLite-backed store for processed documents, chats and chat messages.
+
+    One connection is shared by all sessions, so every statement runs under a lock.
+    Documents and chats belong to an owner (see chat_owner_id in app.py) and every
+    read, write and delete is scoped to it, so sessions never see each other's rows.
+    A chat is its name and the ids of the documents / tools it was created with (JSON),
+    so it can be rebuilt after a restart. Messages are kept one row per turn as (role, parts),
+    where parts is a JSON list of {'text'}, {'function_call'} or {'function_response'} dicts.
+    """
+    def __init__(self, db_path: str = CHAT_DB_PATH):
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        if self._conn.execute("PRAGMA user_version").fetchone()[0] < _SCHEMA_VERSION:
+            # Rows written before documents and chats had an owner can't be attributed to anyone,
+            # and messages stored one chunk per row can't be paired back into turns
+            self._conn.executescript("DROP TABLE IF EXISTS files; DROP TABLE IF EXISTS chats; DROP TABLE IF EXISTS chat_sessions;")
+            self._conn.execute(f"PRAGMA user_version = {_SCHEMA_VERSION}")
+        self._conn.executescript(_SCHEMA)
+        with self._conn:
+            # Messages of chats that were never recorded (written before chats were stored) can't be restored
+            self._conn.execute("DELETE FROM chats WHERE chat_id NOT IN (SELECT chat_id FROM chat_sessions)")
+        self._lock = threading.Lock()
+
+    def record_file(self, owner: str, file_id: str, name: str, path: str) -> None:
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO files (owner, id, name, path) VALUES (?, ?, ?, ?)",
+                (owner, file_id, name, path)
+            )
+
+    def file_path(self, owner: str, file_id: str):
+        """Returns the temp file owner recorded for file_id if it still exists, otherwise None."""
+        with self._lock:
+            row = self._conn.execute("SELECT path FROM files WHERE owner = ? AND id = ?", (owner, file_id)).fetchone()
+        if row and os.path.exists(row[0]):
+            return row[0]
+        return None
+
+    def list_files(self, owner: str) -> list:
+        """Returns owner's processed documents whose temp file still exists; stale rows are dropped."""
+        with self._lock:
+            rows = self._conn.execute("SELECT id, name, path FROM files WHERE owner = ?", (owner,)).fetchall()
+        files = []
+        for file_id, name, path in rows:
+            if os.path.exists(path):
+                files.append({"id": file_id, "name": name, "path": path})
+            else:
+                with self._lock, self._conn:
+                    self._conn.execute("DELETE FROM files WHERE owner = ? AND id = ?", (owner, file_id))
+        return files
+
+    def record_chat(self, owner: str, chat_id: str, name: str, tool_ids: list) -> None:
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO chat_sessions (chat_id, owner, name, tool_ids) VALUES (?, ?, ?, ?)",
+                (chat_id, owner, name, json.dumps(tool_ids, ensure_ascii=False))
+            )
+
+    def list_chats(self, owner: str) -> list:
+        """Returns owner's stored chats, oldest first, as dicts with chat_id, name and tool_ids."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT chat_id, name, tool_ids FROM chat_sessions WHERE owner = ? ORDER BY rowid", (owner,)
+            ).fetchall()
+        return [{"chat_id": chat_id, "name": name, "tool_ids": json.loads(tool_ids)} for chat_id, name, tool_ids in rows]
+
+    def _owns_chat(self, owner: str, chat_id: str) -> bool:
+        return self._conn.execute(
+            "SELECT 1 FROM chat_sessions WHERE chat_id = ? AND owner = ?", (chat_id, owner)
+        ).fetchone() is not None
+
+    def count_messages(self, owner: str, chat_id: str) -> int:
+        with self._lock:
+            if not self._owns_chat(owner, chat_id):
+                return 0
+            return self._conn.execute("SELECT COUNT(*) FROM chats WHERE chat_id = ?", (chat_id,)).fetchone()[0]
+
+    def append_messages(self, owner: str, chat_id: str, messages: list) -> None:
+        """Appends (role, parts) tuples after the chat's last stored message. Ignored for chats owner doesn't own."""
+        with self._lock, self._conn:
+            if not self._owns_chat(owner, chat_id):
+                return
+            start = self._conn.execute("SELECT COUNT(*) FROM chats WHERE chat_id = ?", (chat_id,)).fetchone()[0]
+            self._conn.executemany(
+                "INSERT INTO chats (chat_id, idx, role, parts) VALUES (?, ?, ?, ?)",
+                [(chat_id, start + i, role, parts) for i, (role, parts) in enumerate(messages)]
+            )
+
+    def load_messages(self, owner: str, chat_id: str, limit: int) -> list:
+        """Returns the last `limit` messages of one of owner's chats, oldest first."""
+        with self._lock:
+            if not self._owns_chat(owner, chat_id):
+                return []
+            rows = self._conn.execute(
+                "SELECT role, parts FROM chats WHERE chat_id = ? ORDER BY idx DESC LIMIT ?",
+                (chat_id, limit)
+            ).fetchall()
+        return rows[::-1]
+
+    def delete_chat(self, owner: str, chat_id: str) -> None:
+        """Deletes one of owner's chats and all of its messages."""
+        with self._lock, self._conn:
+            if not self._owns_chat(owner, chat_id):
+                return
+            self._conn.execute("DELETE FROM chats WHERE chat_id = ?", (chat_id,))
+            self._conn.execute("DELETE FROM chat_sessions WHERE chat_id = ?", (chat_id,))
+
+
+def _serialize_part(part):
+    """Converts a google.genai Part to a JSON-able dict, or None for parts that aren't kept (thoughts, blobs)."""
+    if part.function_call:
+        return {"function_call": {"name": part.function_call.name, "args": part.function_call.args}}
+    if part.function_response:
+        return {"function_response": {"name": part.function_response.name, "response": part.function_response.response}}
+    if part.text and not part.thought:
+        return {"text": part.text}
+    return None
+
+
+def serialize_history(messages) -> list:
+    """
+    Converts google.genai Content messages to (role, parts) rows, one per turn.
+
+    send_message_stream records one Content per streamed chunk, so consecutive model
+    messages are merged into a single turn with adjacent text joined. Every part is kept,
+    so mixed text / function_call turns and parallel calls still pair with their responses.
+    """
+    turns = []
+    for message in messages:
+        parts = [serialized for serialized in map(_serialize_part, message.parts or []) if serialized]
+        if turns and message.role == "model" and turns[-1][0] == "model":
+            turns[-1][1].extend(parts)
+        else:
+            turns.append((message.role, parts))
+    rows = []
+    for role, parts in turns:
+        merged_parts = []
+        for part in parts:
+            if "text" in part and merged_parts and "text" in merged_parts[-1]:
+                merged_parts[-1] = {"text": merged_parts[-1]["text"] + part["text"]}
+            else:
+                merged_parts.append(part)
+        if merged_parts:
+            rows.append((role, json.dumps(merged_parts, ensure_ascii=False, default=str)))
+    return rows
+
+
+def deserialize_message(role, parts):
+    """Converts a (role, parts) row back to a google.genai Content message, to restore a chat's history."""
+    from google.genai import types
+    content_parts = []
+    for part in json.loads(parts):
+        if "text" in part:
+            content_parts.append(types.Part(text=part["text"]))
+        elif "function_call" in part:
+            content_parts.append(types.Part(function_call=types.FunctionCall(**part["function_call"])))
+        else:
+            content_parts.append(types.Part(function_response=types.FunctionResponse(**part["function_response"])))
+    return types.Content(role=role, parts=content_parts)
+
+
+@st.cache_resource
+def get_chat_store() -> ChatStore:
+    """Returns the process-wide ChatStore."""
+    return ChatStore()
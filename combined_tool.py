@@ -1,10 +1,11 @@
 import itertools
-from google.genai import Client, types
+from google.genai import types
+from google_client import get_google_client
 
 
 def get_answer_to_query(query:str, tools_list: list) -> str:
     tools = list(itertools.chain.from_iterable(tools_list))
-    client = Client()
+    client = get_google_client()
 
     config = types.GenerateContentConfig(
         tools=tools)  # Pass the function itself
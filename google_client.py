@@ -0,0 +1,13 @@
+import streamlit as st
+
+
+@st.cache_resource
+def get_google_client():
+    """
+    Returns the Google GenAI client shared by all sessions and tools.
+
+    The client is threadsafe, so one instance (and its HTTP connection pool)
+    serves every browser tab instead of one per session or per tool call.
+    """
+    from google.genai import Client
+    return Client()
@@ -1,17 +1,42 @@
 import pandas as pd
 import os
 from langchain_community.document_loaders import (
-    PyPDFLoader,      # Uses pypdf
     CSVLoader,
     Docx2txtLoader,   # Uses docx2txt
     TextLoader
 )
-import tempfile
+import multiprocessing
+import pymupdf
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from google.genai import Client, types
 
+import functools
+from langchain.embeddings import CacheBackedEmbeddings
+from langchain.storage import LocalFileStore
+from langchain_core.document_loaders import BaseLoader
+from langchain_core.documents import Document
+from langchain_text_splitters import RecursiveCharacterTextSplitter
 from langchain_openai import OpenAIEmbeddings
+from langchain_community.docstore.in_memory import InMemoryDocstore
 from langchain_community.vectorstores.faiss import FAISS
-
+import faiss
+import numpy as np
+
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", "512"))
+EMBEDDING_CACHE_DIR = os.path.join(".cache", "embeddings")
+RETRIEVER_TOP_K = 4
+INGEST_MAX_WORKERS = 8
+# PDFs shorter than two of these are extracted in-process, process start-up would cost more than it saves
+PDF_PAGES_PER_WORKER = 50
+HNSW_M = 32
+HNSW_EF_CONSTRUCTION = 200
+HNSW_EF_SEARCH = 64
+# Only a sample of the document goes to Gemini for the tool description
+DESCRIPTION_HEAD_CHARS = 4000
+DESCRIPTION_MIDDLE_CHARS = 2000
+DESCRIPTION_TAIL_CHARS = 2000
+# Shared by every file; same chunking as load_and_split's default splitter
+DOCUMENT_SPLITTER = RecursiveCharacterTextSplitter(chunk_size=4000, chunk_overlap=200)
 
 DOCUMENT_DESCRIPTION_PROMPT = """Given the following document text, write an LLM tool description. The description should summarize the document's content and specify the types of user questions for which information should be retrieved from this document. Just write the content with no formatting"""
 
@@ -30,16 +55,103 @@ Returns context:
             user's question.
 """
 
+@functools.lru_cache(maxsize=None)
+def get_embedding_store() -> LocalFileStore:
+    """Returns the process-wide on-disk store of document embeddings."""
+    return LocalFileStore(EMBEDDING_CACHE_DIR)
+
+@functools.lru_cache(maxsize=None)
+def get_embeddings() -> OpenAIEmbeddings:
+    """Returns the process-wide OpenAI embeddings client, so every Retriever reuses its HTTP connections."""
+    return OpenAIEmbeddings(chunk_size=EMBEDDING_BATCH_SIZE, max_retries=6)
+
+@functools.lru_cache(maxsize=None)
+def get_cached_embeddings() -> CacheBackedEmbeddings:
+    """
+    Returns get_embeddings() behind the on-disk embedding cache.
+
+    Chunks embedded before (in any session or process) are read back from disk instead of re-embedded.
+    The namespace keeps vectors from different models apart.
+    """
+    base_embeddings = get_embeddings()
+    return CacheBackedEmbeddings.from_bytes_store(
+        base_embeddings,
+        get_embedding_store(),
+        namespace=base_embeddings.model,
+        key_encoder="sha256"
+    )
+
+@functools.lru_cache(maxsize=512)
+def _embed_query(search_phrase: str) -> tuple:
+    """Embeds a search phrase once; every document tool queried with it in a chat turn reuses the vector."""
+    return tuple(get_embeddings().embed_query(search_phrase))
+
+def _extract_pdf_pages(file_path: str, start: int, stop: int) -> list[str]:
+    """Extracts the text of pages [start, stop). Runs in a worker process, so it opens its own handle."""
+    with pymupdf.open(file_path) as pdf:
+        return [pdf[i].get_text() for i in range(start, stop)]
+
+PDF_WORKER_CONTEXT = multiprocessing.get_context(
+    "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+)
+
+class ParallelPyMuPDFLoader(BaseLoader):
+    """
+    Loads a PDF one Document per page, extracting pages in parallel for long files.
+
+    PyMuPDF isn't thread-safe, so the pages are split into contiguous ranges
+    and each range is extracted by a separate process with its own handle.
+    Workers are started fresh (forkserver, or spawn where that's unavailable)
+    rather than forked, since forking the Streamlit server copies its threads'
+    held locks into the child.
+    """
+    def __init__(self, file_path: str):
+        self.file_path = file_path
+
+    def lazy_load(self):
+        with pymupdf.open(self.file_path) as pdf:
+            page_count = pdf.page_count
+        workers = min(os.cpu_count() or 1, page_count // PDF_PAGES_PER_WORKER)
+        if workers <= 1:
+            texts = _extract_pdf_pages(self.file_path, 0, page_count)
+        else:
+            bounds = [page_count * i // workers for i in range(workers + 1)]
+            with ProcessPoolExecutor(max_workers=workers, mp_context=PDF_WORKER_CONTEXT) as executor:
+                page_ranges = executor.map(_extract_pdf_pages, [self.file_path] * workers, bounds[:-1], bounds[1:])
+                texts = [text for page_range in page_ranges for text in page_range]
+        for i, text in enumerate(texts):
+            yield Document(page_content=text, metadata={"source": self.file_path, "page": i, "total_pages": page_count})
+
+# Loader factory per supported file extension
+LOADERS = {
+    ".txt": lambda file_path: TextLoader(file_path, encoding='utf-8'), # Specify encoding for robustness
+    ".pdf": ParallelPyMuPDFLoader,
+    # CSVLoader by default treats each row as a document.
+    # You might want to specify source_column if one column contains the main text.
+    ".csv": lambda file_path: CSVLoader(file_path, encoding='utf-8'), # Specify encoding
+    ".docx": Docx2txtLoader,
+}
+
 # --- Retriever Class (as you defined it) ---
 class Retriever():
     def __init__(self, documents):
-        self.embeddings = OpenAIEmbeddings()
-        self.vectorstore = FAISS.from_documents(documents=documents, embedding=self.embeddings)
-        self.retriever = self.vectorstore.as_retriever()
+        self.embeddings = get_cached_embeddings()
+        # Embed all chunks up front (the base client batches EMBEDDING_BATCH_SIZE per request), then build the index from the vectors
+        texts = [doc.page_content for doc in documents]
+        metadatas = [doc.metadata for doc in documents]
+        vectors = self.embeddings.embed_documents(texts)
+        # HNSW graph instead of the default flat index, so queries don't scan every chunk.
+        # Vectors are stored as int8 (a quarter of fp32), the quantizer learns per-dimension ranges from the chunks.
+        index = faiss.IndexHNSWSQ(len(vectors[0]), faiss.ScalarQuantizer.QT_8bit, HNSW_M)
+        index.train(np.array(vectors, dtype="float32"))
+        index.hnsw.efConstruction = HNSW_EF_CONSTRUCTION
+        index.hnsw.efSearch = HNSW_EF_SEARCH
+        self.vectorstore = FAISS(embedding_function=self.embeddings, index=index, docstore=InMemoryDocstore(), index_to_docstore_id={})
+        self.vectorstore.add_embeddings(list(zip(texts, vectors)), metadatas=metadatas)
 
     def retrieve_documents(self, search_phrase: str) -> list[str]:
         """Retrieves documents based on a given search phrase."""
-        retrieved_documents = self.retriever.invoke(search_phrase)
+        retrieved_documents = self.vectorstore.similarity_search_by_vector(list(_embed_query(search_phrase)), k=RETRIEVER_TOP_K)
         return [doc.page_content for doc in retrieved_documents]
 
 # --- Function to create specialized retrieval functions ---
@@ -84,40 +196,24 @@ def extract_content_with_specific_loaders(file_path):
         return None, None
 
     _, file_extension = os.path.splitext(file_path.lower())
-    loader = None
-    extracted_text = ""
-    documents = []
 
     print(f"Attempting to load file: {file_path} with extension: {file_extension}")
 
     try:
-        if file_extension == ".txt":
-            loader = TextLoader(file_path, encoding='utf-8') # Specify encoding for robustness
-        elif file_extension == ".pdf":
-            loader = PyPDFLoader(file_path)
-        elif file_extension == ".csv":
-            # CSVLoader by default treats each row as a document.
-            # You might want to specify source_column if one column contains the main text.
-            loader = CSVLoader(file_path, encoding='utf-8') # Specify encoding
-        elif file_extension == ".docx":
-            loader = Docx2txtLoader(file_path)
-        else:
+        loader_factory = LOADERS.get(file_extension)
+        if loader_factory is None:
             print(f"Unsupported file type: {file_extension}")
             return None, None
+        loader = loader_factory(file_path)
 
-        if loader:
-            print(f"Using loader: {loader.__class__.__name__}")
-            documents = loader.load_and_split()  # Returns a list of Document objects
-            
-            # Concatenate page_content from all Document objects
-            for doc in documents:
-                if hasattr(doc, 'page_content'):
-                    extracted_text += doc.page_content + "\n"
-                else:
-                    print(f"Warning: Document object from {loader.__class__.__name__} lacks 'page_content'. Doc: {doc}")
-            
-            print(f"Successfully extracted content. Total characters: {len(extracted_text)}")
-            return extracted_text.strip(), documents
+        print(f"Using loader: {loader.__class__.__name__}")
+        documents = DOCUMENT_SPLITTER.split_documents(loader.lazy_load())  # Returns a list of Document objects
+
+        # Concatenate page_content from all Document objects
+        extracted_text = "\n".join(doc.page_content for doc in documents)
+
+        print(f"Successfully extracted content. Total characters: {len(extracted_text)}")
+        return extracted_text.strip(), documents
 
     except Exception as e:
         print(f"An error occurred while processing the file {file_path}: {e}")
@@ -126,14 +222,29 @@ def extract_content_with_specific_loaders(file_path):
         # print(traceback.format_exc())
         return None, None
 
+def sample_document_text(text: str) -> str:
+    """Returns the start, middle and end of a long document, enough for Gemini to describe what it covers."""
+    if len(text) <= DESCRIPTION_HEAD_CHARS + DESCRIPTION_MIDDLE_CHARS + DESCRIPTION_TAIL_CHARS:
+        return text
+    middle = len(text) // 2
+    return "\n...\n".join([
+        text[:DESCRIPTION_HEAD_CHARS],
+        text[middle:middle + DESCRIPTION_MIDDLE_CHARS],
+        text[-DESCRIPTION_TAIL_CHARS:]
+    ])
+
 def create_vectorstore_and_retriever(client:Client, text:str, documents):
-    response = client.models.generate_content(
-        model='gemini-2.0-flash',
-        contents=f"{DOCUMENT_DESCRIPTION_PROMPT}\n\n{text}"
-    )
+    # The description and the index don't depend on each other, so the embeddings
+    # and index build run on a second thread while Gemini writes the description
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        retriever_future = executor.submit(Retriever, documents=documents)
+        response = client.models.generate_content(
+            model='gemini-2.0-flash',
+            contents=f"{DOCUMENT_DESCRIPTION_PROMPT}\n\n{sample_document_text(text)}"
+        )
+        retriever_instance = retriever_future.result()
     doc_description = response.text
     tool_description = RETRIEVER_DOCSTRING.format(DOCUMENT_DESCRIPTION=doc_description)
-    retriever_instance = Retriever(documents=documents)
     retriever_function = create_specialized_retriever_function(retriever_obj=retriever_instance, docstring_text=tool_description)
     return retriever_function
 
@@ -143,79 +254,59 @@ def get_retriever_function(file_path:str, client: Client):
         raise Exception("Failed to extract the contents of the file")
     return create_vectorstore_and_retriever(client=client, text=document_text, documents=documents)
 
-def excel_to_multiple_csv(excel_file_path: str, output_directory: str = None):
+def excel_to_documents(excel_file_path: str):
     """
-    Converts an Excel file with multiple sheets into separate CSV files,
-    one for each sheet.
+    Reads every sheet of an Excel file into Langchain Documents in memory, one per row.
+
+    Rows are formatted like CSVLoader does ("column: value" per line), so the
+    documents match what the CSV round trip used to produce.
 
     Args:
         excel_file_path (str): The path to the input Excel (.xlsx or .xls) file.
-        output_directory (str, optional): The directory where the CSV files
-                                          will be saved. If None, CSV files
-                                          will be saved in the same directory
-                                          as the Excel file. Defaults to None.
+
     Returns:
-        bool: True if the conversion was successful, False otherwise.
+        list[tuple]: (text, documents) per non-empty sheet.
     """
-    if not os.path.exists(excel_file_path):
-        print(f"Error: Excel file not found at '{excel_file_path}'")
-        return False
-
-    if not excel_file_path.lower().endswith(('.xlsx', '.xls')):
-        print(f"Error: The provided file '{excel_file_path}' is not a valid Excel file.")
-        return False
-
-    # Determine the output directory
-    if output_directory is None:
-        output_directory = os.path.dirname(excel_file_path)
-        if not output_directory: # If excel_file_path is just a filename in current dir
-            output_directory = os.getcwd()
-    else:
-        # Create the output directory if it doesn't exist
-        os.makedirs(output_directory, exist_ok=True)
-
-    print(f"Converting '{excel_file_path}' to CSVs in '{output_directory}'...")
-
-    try:
-        # Read all sheets from the Excel file into a dictionary of DataFrames
-        # The keys of the dictionary will be the sheet names
-        excel_sheets = pd.read_excel(excel_file_path, sheet_name=None)
-
-        if not excel_sheets:
-            print("No sheets found in the Excel file.")
-            return False
-
-        for sheet_name, df in excel_sheets.items():
-            # Sanitize sheet name for filename (replace problematic characters)
-            sanitized_sheet_name = "".join(c for c in sheet_name if c.isalnum() or c in (' ', '_')).rstrip()
-            csv_filename = f"{sanitized_sheet_name}.csv"
-            csv_file_path = os.path.join(output_directory, csv_filename)
-
-            # Write the DataFrame to a CSV file
-            df.to_csv(csv_file_path, index=False, encoding='utf-8')
-            print(f"  - Successfully created '{csv_file_path}'")
-
-        print("Conversion complete!")
-        return True
-
-    except Exception as e:
-        print(f"An error occurred during conversion: {e}")
-        return False
+    excel_sheets = pd.read_excel(excel_file_path, sheet_name=None, engine="calamine")
+    sheets = []
+    for sheet_name, df in excel_sheets.items():
+        documents = []
+        for i, record in enumerate(df.to_dict("records")):
+            page_content = "\n".join(f"{column}: {'' if pd.isna(value) else value}" for column, value in record.items())
+            documents.append(Document(page_content=page_content, metadata={"source": excel_file_path, "sheet": sheet_name, "row": i}))
+        if documents:
+            sheets.append(("\n".join(doc.page_content for doc in documents), documents))
+    return sheets
 
 
 def process_files_and_get_chat_object(file_path_list: list[str], client:Client):
     tool_list = []
+    # Expand Excel workbooks into one job per sheet first, so every sheet and file can be ingested in parallel
+    jobs = []
     for file_path in file_path_list:
         if file_path.endswith((".xlsx",".xls")):
-            with tempfile.TemporaryDirectory as temp_dir:
-                if not excel_to_multiple_csv(file_path, temp_dir):
-                    raise Exception("Failed to extract content from excel files")
-                for csv_file_path in os.listdir(temp_dir):
-                    tool = get_retriever_function(file_path=csv_file_path, client=client)
-                    tool_list.append(tool)
+            try:
+                sheets = excel_to_documents(file_path)
+            except Exception as e:
+                raise Exception("Failed to extract content from excel files") from e
+            for text, documents in sheets:
+                jobs.append((file_path, functools.partial(create_vectorstore_and_retriever, client=client, text=text, documents=documents)))
         else:
-            tool = get_retriever_function(file_path=file_path, client=client)
-            tool_list.append(tool)
+            jobs.append((file_path, functools.partial(get_retriever_function, file_path=file_path, client=client)))
+
+    # Each job is a Gemini description call plus an embedding batch, all I/O bound
+    with ThreadPoolExecutor(max_workers=max(1, min(INGEST_MAX_WORKERS, len(jobs)))) as executor:
+        futures = [executor.submit(job) for _, job in jobs]
+        # Collected in submission order so the tool list is stable for the same files
+        for (file_path, _), future in zip(jobs, futures):
+            try:
+                tool_list.append(future.result())
+            except Exception as e:
+                # One unreadable file shouldn't discard the others
+                print(f"Failed to process {file_path}: {e}")
+
+    if jobs and not tool_list:
+        raise Exception("Failed to extract the contents of the files")
     
     # config = types.GenerateContentConfig(
         # tools=tool_list
@@ -1,6 +1,13 @@
 import os
 import json
 import asyncio
+import concurrent.futures
+import functools
+import shutil
+import tempfile
+import threading
+import time
+from datetime import date
 import aiofiles  # Added for async file operations
 
 from openai import AsyncOpenAI  # Changed to AsyncOpenAI
@@ -12,6 +19,7 @@ import pandas as pd  # Assuming fs[i] is a pandas DataFrame for to_csv
 from typing import Dict, Any
 import streamlit as st
 import uuid
+import weakref
 
 from dotenv import load_dotenv
 
@@ -22,79 +30,154 @@ OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 TAVILY_API_KEY = os.getenv("TAVILY_API_KEY")
 SEC_API_KEY = os.getenv("SEC_API_KEY")
 DART_API_KEY = os.getenv("DART_API_KEY")
+DART_SAVE_CONCURRENCY = int(os.getenv("DART_SAVE_CONCURRENCY", "8"))
+DART_FETCH_CONCURRENCY = int(os.getenv("DART_FETCH_CONCURRENCY", "8"))
+DART_CACHE_TTL_SECONDS = int(os.getenv("DART_CACHE_TTL_SECONDS", "86400"))
+COMPANY_INFO_CACHE_TTL_SECONDS = int(os.getenv("COMPANY_INFO_CACHE_TTL_SECONDS", "3600"))
+SEC_CACHE_TTL_SECONDS = int(os.getenv("SEC_CACHE_TTL_SECONDS", "86400"))
+# Streamed research output is pushed to the browser at most this often
+STREAM_FLUSH_SECONDS = 0.1
+
+# AsyncOpenAI clients per event loop: httpx connection pools can't be shared across loops
+_openai_clients = weakref.WeakKeyDictionary()
+_tavily_clients = weakref.WeakKeyDictionary()
+
+
+def get_openai_client() -> AsyncOpenAI:
+    """Returns the AsyncOpenAI client for the running event loop, creating it on first use."""
+    loop = asyncio.get_running_loop()
+    client = _openai_clients.get(loop)
+    if client is None:
+        client = AsyncOpenAI(api_key=OPENAI_API_KEY)
+        _openai_clients[loop] = client
+    return client
+
+
+def get_tavily_client() -> AsyncTavilyClient:
+    """Returns the AsyncTavilyClient for the running event loop, creating it on first use."""
+    loop = asyncio.get_running_loop()
+    client = _tavily_clients.get(loop)
+    if client is None:
+        client = AsyncTavilyClient(api_key=TAVILY_API_KEY)
+        _tavily_clients[loop] = client
+    return client
+
+
+class StreamlitLogHandler:
+    """
+    A custom logs handler for GPTResearcher that streams logs and the report,
+    as it is written, to Streamlit containers.
+
+    Updates are buffered and flushed at most every STREAM_FLUSH_SECONDS, and only
+    containers that changed are rewritten, so token-by-token output doesn't turn
+    into one websocket message per token. Output buffered between flushes is written
+    by a trailing flush STREAM_FLUSH_SECONDS later, so the end of a burst isn't held
+    back until the next message. Call flush() once the researcher is done.
+
+    The report is rendered block by block: paragraphs that are complete (followed by
+    a blank line) are written once into their own placeholder, and each flush only
+    re-renders the trailing block that is still being written.
+    """
 
+    def __init__(self, logs_container, report_container):
+        """
+        Initializes the handler with Streamlit containers.
+
+        Args:
+            logs_container: A Streamlit container (e.g., returned by st.empty()) for research logs.
+            report_container: A Streamlit container for the partial report.
+        """
+        self.logs_container = logs_container
+        self.report_container = report_container
+        self.logs = ""
+        self.report_content = ""
+        self.lock = asyncio.Lock()  # To handle async updates safely
+        self._logs_dirty = False
+        self._report_dirty = False
+        self._last_flush = 0.0
+        self._flush_timer = None  # Trailing flush scheduled for output buffered since the last flush
+        # Block-wise report rendering state, created on the first report flush
+        self._report_blocks = None
+        self._report_tail = None
+        self._report_done = 0  # Length of report_content already rendered as complete blocks
+
+    async def send_json(self, data: Dict[str, Any]) -> None:
+        """
+        Receives JSON data from GPTResearcher and displays it in Streamlit.
+        This method is called by GPTResearcher during its process.
+        """
+        async with self.lock:
+            # Extract a meaningful message or format the JSON
+            if 'message' in data:
+                message = data['message']
+            elif 'output' in data:
+                message = data['output']
+            else:
+                message = f"```json\n{json.dumps(data, indent=2, default=str)}\n```"
 
-# COMMENTED OUT: StreamlitLogHandler class for streaming logs
-# class StreamlitLogHandler:
-#     """
-#     A custom logs handler for GPTResearcher that streams logs to a
-#     Streamlit container.
-#     """
-
-#     def __init__(self, logs_container, report_container):
-#         """
-#         Initializes the handler with a Streamlit container.
-
-#         Args:
-#             container: A Streamlit container (e.g., returned by st.empty()).
-#         """
-#         self.logs_container = logs_container
-#         self.report_container = report_container
-#         self.logs = ""
-#         self.report_content = ""
-#         self.lock = asyncio.Lock()  # To handle async updates safely
-
-#     async def send_json(self, data: Dict[str, Any]) -> None:
-#         """
-#         Receives JSON data from GPTResearcher and displays it in Streamlit.
-#         This method is called by GPTResearcher during its process.
-#         """
-#         async with self.lock:
-#             if data['type'] == 'report':
-#                 try:
-#                     # Extract a meaningful message or format the JSON
-#                     if 'message' in data:
-#                         message = data['message']
-#                     elif 'output' in data:
-#                         message = data['output']
-#                     else:
-#                         # Default to a formatted JSON string
-#                         message = f"```json\n{json.dumps(data, indent=2)}\n```"
-
-#                     # Append new log and update the container
-#                     self.report_content += message + "\n\n"
-#                     self.report_container.markdown(self.report_content)
-
-#                 except Exception as e:
-#                     # Fallback for any processing errors
-#                     error_message = f"Error processing log: {e}\n{str(data)}\n\n"
-#                     self.report_content += error_message
-#                     self.report_container.warning(error_message)
-#             else:
-#                 try:
-#                     # Extract a meaningful message or format the JSON
-#                     if 'message' in data:
-#                         message = data['message']
-#                     elif 'output' in data:
-#                         message = data['output']
-#                     else:
-#                         # Default to a formatted JSON string
-#                         message = f"```json\n{json.dumps(data, indent=2)}\n```"
-
-#                     # Append new log and update the container
-#                     self.logs += message + "\n\n"
-#                     self.logs_container.markdown(self.logs)
-
-#                 except Exception as e:
-#                     # Fallback for any processing errors
-#                     error_message = f"Error processing log: {e}\n{str(data)}\n\n"
-#                     self.logs += error_message
-#                     self.logs_container.warning(error_message)
+            if data.get('type') == 'report':
+                # Report chunks arrive token by token, so they are concatenated as is
+                self.report_content += str(message)
+                self._report_dirty = True
+            else:
+                self.logs += f"{message}\n\n"
+                self._logs_dirty = True
+
+            since_flush = time.monotonic() - self._last_flush
+            if since_flush >= STREAM_FLUSH_SECONDS:
+                self.flush()
+            elif self._flush_timer is None:
+                self._flush_timer = asyncio.get_running_loop().call_later(STREAM_FLUSH_SECONDS - since_flush, self.flush)
+
+    def flush(self) -> None:
+        """Writes buffered output to the containers that changed since the last flush."""
+        if self._flush_timer is not None:
+            self._flush_timer.cancel()
+            self._flush_timer = None
+        try:
+            if self._report_dirty:
+                self._render_report()
+            if self._logs_dirty:
+                self.logs_container.markdown(self.logs)
+        except Exception as e:
+            # Fallback for any processing errors
+            self.logs_container.warning(f"Error processing log: {e}")
+        self._report_dirty = self._logs_dirty = False
+        self._last_flush = time.monotonic()
+
+
+    def _render_report(self) -> None:
+        """Renders newly completed report blocks once and re-renders only the trailing one."""
+        if self._report_blocks is None:
+            self._report_blocks = self.report_container.container()
+            self._report_tail = self._report_blocks.empty()
+        blocks = self.report_content[self._report_done:].split("\n\n")
+        pending = blocks.pop()
+        current = None
+        for block in blocks:
+            current = block if current is None else f"{current}\n\n{block}"
+            if current.count("```") % 2:
+                # Inside an open code fence, blank lines don't end the block
+                continue
+            self._report_tail.markdown(current)
+            self._report_tail = self._report_blocks.empty()
+            self._report_done += len(current) + 2
+            current = None
+        if current is not None:
+            pending = f"{current}\n\n{pending}"
+        self._report_tail.markdown(pending)
+
+
+def make_log_handler(logs_container, report_container):
+    """Returns a StreamlitLogHandler when both containers are given, otherwise None (no streaming)."""
+    if logs_container is None or report_container is None:
+        return None
+    return StreamlitLogHandler(logs_container, report_container)
 
 
 async def tavily_web_search(url, num_results=5):
     """Perform a web search using Tavily API and return relevant information asynchronously."""
-    client = AsyncTavilyClient(api_key=TAVILY_API_KEY)
+    client = get_tavily_client()
     search_query = "Information about " + url + " and Top competitors of " + url + "with its Ticker"
     response = client.extract(urls=url)
     search_response = await client.search(
@@ -172,7 +255,7 @@ async def generate_company_information(url, language):
         "competitors": ["Competitor 1", "Competitor 2", "Competitor 3", "Competitor 4", "Competitor 5"]
     }}
     """
-    client = AsyncOpenAI(api_key=OPENAI_API_KEY)
+    client = get_openai_client()
 
     # Initial call to determine if a tool (web search) is needed
     response = await client.chat.completions.create(
@@ -262,38 +345,102 @@ async def generate_company_information(url, language):
     return {"error": "No content or tool call from LLM."}
 
 
-async def get_dart_company_information(company_name, first_name):
-    corp_list = dart.get_corp_list()
-    corp = None
+class _CompanyInfoError(Exception):
+    """Raised inside the cached company lookup so error results aren't cached."""
+    def __init__(self, result):
+        super().__init__(result)
+        self.result = result
+
 
-    # First try with full company name
+@st.cache_data(ttl=COMPANY_INFO_CACHE_TTL_SECONDS, show_spinner=False, max_entries=256)
+def _fetch_company_information(url, language):
+    """Runs generate_company_information in its own loop; keyed by (url, language)."""
+    result = asyncio.run(generate_company_information(url, language))
+    if not isinstance(result, dict) or "error" in result:
+        raise _CompanyInfoError(result)
+    return result
+
+
+async def generate_company_information_cached(url, language, refresh=False):
+    """
+    Like generate_company_information, but successful results are reused across reruns and sessions.
+    With refresh, the cached result is dropped and looked up again.
+    """
+    if refresh:
+        _fetch_company_information.clear(url, language)
     try:
-        corp = corp_list.find_by_corp_name(company_name, exactly=True, market='YKNE')
-        if not corp:
-            corp = corp_list.find_by_corp_name(company_name, exactly=False, market='YKNE')
+        # asyncio.run inside the cached function needs a thread without a running loop
+        return await asyncio.to_thread(_fetch_company_information, url, language)
+    except _CompanyInfoError as e:
+        return e.result
+
+
+async def prefetch_dart_corp_list():
+    """
+    Loads dart_fss's corp list, which it keeps in memory after the first call.
+    Only needs the API key, so callers can start it before the company is known. Failures are left
+    to the real lookup, which reports them.
+    """
+    _set_dart_api_key()
+    try:
+        await asyncio.to_thread(dart.get_corp_list)
+    except Exception as e:
+        print(f"Error prefetching DART corp list: {type(e).__name__}: {e}")
+
+
+def _find_dart_corps(corp_list, name):
+    """
+    Returns the corps named exactly `name`, or else those whose name contains it.
+    One partial-match scan of the corp list serves both, exact matches are picked out of it.
+    """
+    try:
+        matches = corp_list.find_by_corp_name(name, exactly=False, market='YKNE') or []
     except:
-        pass
+        return []
+    exact_matches = [corp for corp in matches if corp.corp_name == name]
+    return exact_matches or matches
 
-    # If not found, try with first name
+
+async def get_dart_company_information(company_name, first_name):
+    corp_list = await asyncio.to_thread(dart.get_corp_list)
+
+    # First try with full company name, if not found, try with first name
+    corp = _find_dart_corps(corp_list, company_name)
     if not corp:
-        try:
-            corp = corp_list.find_by_corp_name(first_name, exactly=True, market='YKNE')
-            if not corp:
-                corp = corp_list.find_by_corp_name(first_name, exactly=False, market='YKNE')
-        except:
-            pass
+        corp = _find_dart_corps(corp_list, first_name)
 
     # If still not found, return None
     if not corp:
         return "This company is not in the dart list"
 
-    corp_data = []
-    for info in corp:
-        corp_code = info.corp_code
-        corp_info = dart.api.filings.get_corp_info(corp_code=corp_code)
-        corp_data.append(corp_info)
+    # The per-candidate lookups are independent, fetch them concurrently, but at most
+    # DART_FETCH_CONCURRENCY at a time: common name prefixes match dozens of corps and DART rate limits bursts
+    fetch_semaphore = asyncio.Semaphore(DART_FETCH_CONCURRENCY)
+
+    async def fetch_corp_info(corp_code):
+        async with fetch_semaphore:
+            return await asyncio.to_thread(dart.api.filings.get_corp_info, corp_code=corp_code)
+
+    corp_data = await asyncio.gather(*(fetch_corp_info(info.corp_code) for info in corp))
+
+    return list(corp_data)
+
 
-    return corp_data
+@st.cache_data(ttl=DART_CACHE_TTL_SECONDS, show_spinner=False, max_entries=256)
+def _fetch_dart_company_information(company_name, first_name):
+    """Runs get_dart_company_information in its own loop; keyed by (company_name, first_name)."""
+    return asyncio.run(get_dart_company_information(company_name, first_name))
+
+
+async def get_dart_company_information_cached(company_name, first_name, refresh=False):
+    """
+    Like get_dart_company_information, but results are reused across reports of the same company for a day.
+    With refresh, the cached result is dropped and looked up again.
+    """
+    if refresh:
+        _fetch_dart_company_information.clear(company_name, first_name)
+    # asyncio.run inside the cached function needs a thread without a running loop
+    return await asyncio.to_thread(_fetch_dart_company_information, company_name, first_name)
 
 
 async def generate_corp_code(company_name, short_list_data,url):
@@ -314,7 +461,7 @@ async def generate_corp_code(company_name, short_list_data,url):
     Return only the index of list like 0,1,2 which matches the best. Nothing else just the index.
     """
 
-    client = AsyncOpenAI(api_key=OPENAI_API_KEY)
+    client = get_openai_client()
     response = await client.chat.completions.create(
         model="gpt-4.1-nano",
         messages=[
@@ -347,93 +494,43 @@ async def read_json_async(file_path):
         return []
 
 
-async def short_list(company_name, company_first_name):
-    """
-    Search for companies in a list that match either the full company name or first name.
-    Loads the company list from corp_list.json file.
-
-    Args:
-        company_name (str): The full company name to search for
-        company_first_name (str): The company's first name to search for if full name not found
-
-    Returns:
-        list: Matching company objects or a string message if none found
-    """
-    # Initialize empty list to store matching companies
-    short_lists = []
-
-    # Load the company list from file with UTF-8 encoding
-    try:
-        with open("corp_list.json", "r", encoding="utf-8") as f:
-            lis = json.load(f)
-    # except UnicodeDecodeError:
-    #     # Try with a different encoding if UTF-8 fails
-    #     try:
-    #         with open("corp_list.json", "r", encoding="utf-8-sig") as f:
-    #             lis = json.load(f)
-    #     except Exception as e:
-    #         print(f"Error loading JSON file: {type(e).__name__}: {e}")
-    #         return "Error loading company list"
-    except Exception as e:
-        print(f"Error loading JSON file: {type(e).__name__}: {e}")
-        return "Error loading company list"
-
-    # First try with the full company name
-    for corp in lis:
-        try:
-            # Convert the Corp object to a string
-            corp_str = str(corp)
-            # Check if company_name is in the string representation
-            if company_name in corp_str:
-                short_lists.append(corp)
-        except Exception as e:
-            print(f"Error processing item: {type(e).__name__}: {e}")
-
-    # If no matches were found with the full name, try with the first name
-    if len(short_lists) == 0:
-        for corp in lis:
-            try:
-                # Convert the Corp object to a string
-                corp_str = str(corp)
-                # Check if company_first_name is in the string representation
-                if company_first_name in corp_str:
-                    short_lists.append(corp)
-            except Exception as e:
-                print(f"Error processing item: {type(e).__name__}: {e}")
-
-    # If still empty after both searches, return message
-    if len(short_lists) == 0:
-        return "This company is not in the dart list"
-
-    return short_lists
-
-
-async def sec_search(company_name,ticker):
-    """Asynchronously search SEC filings."""
-    if ticker == 'N/A':
-        ticker="corporation"
-
+@st.cache_data(ttl=SEC_CACHE_TTL_SECONDS, show_spinner=False, max_entries=256)
+def _fetch_sec_filings(company_name, ticker):
+    """Runs the SEC full-text search; keyed by (company_name, ticker) since filing lists change at most daily."""
     fullTextSearchApi = FullTextSearchApi(api_key=SEC_API_KEY)
     query = {
         "query": f"{company_name} {ticker}",
         "formTypes": ['10-K','8-K','20-F','10-Q'],
         "startDate": '2020-01-01',
     }
+    return fullTextSearchApi.get_filings(query)
+
+
+async def sec_search(company_name,ticker, refresh=False):
+    """Asynchronously search SEC filings. Results are cached for a day; refresh drops the cached result first."""
+    if ticker == 'N/A':
+        ticker="corporation"
+    if refresh:
+        _fetch_sec_filings.clear(company_name, ticker)
+
     # Run synchronous SDK call in a thread
-    filings = await asyncio.to_thread(fullTextSearchApi.get_filings, query)
+    filings = await asyncio.to_thread(_fetch_sec_filings, company_name, ticker)
     return filings
 
 
-# MODIFIED: Removed streaming containers from function signature
-async def sec_get_report(query: str, report_type: str, sources: list) -> tuple[str, list]:
-    """Generate SEC report using GPTResearcher asynchronously."""
-    # COMMENTED OUT: StreamlitLogHandler for streaming logs
-    # logs_handler = StreamlitLogHandler(logs_container, report_container)
+async def sec_get_report(query: str, report_type: str, sources: list,
+                         logs_container=None, report_container=None) -> tuple[str, list]:
+    """
+    Generate SEC report using GPTResearcher asynchronously.
+
+    When Streamlit containers are given, research logs and the report are streamed
+    into them while the researcher runs; the logs are also returned as the third element.
+    """
+    logs_handler = make_log_handler(logs_container, report_container)
 
     query= query + f"-Add these SEC filings references from source url '{sources}' as well in references"
-    # MODIFIED: Removed websocket parameter (streaming handler)
     researcher = GPTResearcher(query=query, report_type=report_type, source_urls=sources, complement_source_urls=False,
-                               config_path="config.json")
+                               config_path="config.json", websocket=logs_handler)
     researcher.cfg.load_config("config.json")
     # COMMENTED OUT: Report container info messages
     # report_container.info("Starting research... This may take a few minutes. ⏳")
@@ -458,12 +555,13 @@ async def sec_get_report(query: str, report_type: str, sources: list) -> tuple[s
     await researcher.conduct_research()
     # report_container.info("Writing report... This may take a few minutes. ⏳")
     report = await researcher.write_report()
+    if logs_handler:
+        logs_handler.flush()
     research_images = []
     # report_container.info("Writing images... This may take a few minutes. ⏳")
     # research_images = researcher.get_research_images()
 
-    # MODIFIED: Return empty string for logs since streaming is disabled
-    return report, research_images, ""
+    return report, research_images, logs_handler.logs if logs_handler else ""
 
 
 def _save_dataframe_to_csv_sync(df, filename):
@@ -471,9 +569,15 @@ def _save_dataframe_to_csv_sync(df, filename):
     df.to_csv(filename, sep='\t', index=False)
 
 
+@functools.lru_cache(maxsize=None)
+def _set_dart_api_key():
+    """Registers the DART API key with dart_fss once per process."""
+    dart.set_api_key(api_key=DART_API_KEY)
+
+
 async def dart_search(corp_code, temp_dir):
     """Asynchronously search DART and save documents."""
-    dart.set_api_key(api_key=DART_API_KEY)
+    _set_dart_api_key()
 
     # These DART FSS calls are likely synchronous
     corp_list = await asyncio.to_thread(dart.corp.get_corp_list)
@@ -489,9 +593,14 @@ async def dart_search(corp_code, temp_dir):
         return None
 
     folder_name = os.path.join(temp_dir, f"{corp_code}_my_docs")
-    # os.makedirs is synchronous but typically very fast.
-    # For strict async, it could be wrapped with asyncio.to_thread or use an async os lib.
-    os.makedirs(folder_name, exist_ok=True)
+    await asyncio.to_thread(os.makedirs, folder_name, exist_ok=True)
+
+    # Bound the concurrent writes so a large extract doesn't flood the default thread pool
+    save_semaphore = asyncio.Semaphore(DART_SAVE_CONCURRENCY)
+
+    async def save_one(df, filename):
+        async with save_semaphore:
+            await asyncio.to_thread(_save_dataframe_to_csv_sync, df, filename)
 
     save_tasks = []
     if fs_results:  # Check if fs_results is not None and is iterable
@@ -499,7 +608,7 @@ async def dart_search(corp_code, temp_dir):
             if isinstance(df, pd.DataFrame):  # Ensure it's a DataFrame
                 filename = os.path.join(folder_name, f"dataframe_{i}.txt")
                 # Use asyncio.to_thread for pandas I/O operation
-                task = asyncio.to_thread(_save_dataframe_to_csv_sync, df, filename)
+                task = save_one(df, filename)
                 save_tasks.append(task)
                 print(f"Scheduled saving fs[{i}] to {filename}")
             else:
@@ -514,6 +623,68 @@ async def dart_search(corp_code, temp_dir):
     return folder_name
 
 
+class _NoDartStatements(Exception):
+    """Raised inside the cached DART fetch so a miss (or a transient failure) isn't cached."""
+
+
+@st.cache_data(ttl=DART_CACHE_TTL_SECONDS, show_spinner=False, max_entries=128)
+def _fetch_dart_statements(corp_code, date_bucket):
+    """
+    Runs dart_search in a scratch directory and returns {file name: contents}.
+    Keyed by corp_code and the day, so repeat reports for a company skip the DART download.
+    """
+    with tempfile.TemporaryDirectory() as scratch_dir:
+        folder_name = asyncio.run(dart_search(corp_code, scratch_dir))
+        if not folder_name:
+            raise _NoDartStatements(corp_code)
+        statements = {}
+        for file_name in sorted(os.listdir(folder_name)):
+            with open(os.path.join(folder_name, file_name), "r", encoding="utf-8") as f:
+                statements[file_name] = f.read()
+        return statements
+
+
+def _write_statement_files(folder_name, statements):
+    """
+    Synchronous helper to write cached statements back to disk.
+    Files go to a staging directory that is renamed into place, so folder_name only ever appears complete.
+    """
+    staging_dir = tempfile.mkdtemp(dir=os.path.dirname(folder_name))
+    for file_name, contents in statements.items():
+        with open(os.path.join(staging_dir, file_name), "w", encoding="utf-8") as f:
+            f.write(contents)
+    try:
+        os.rename(staging_dir, folder_name)
+    except OSError:
+        # Another run for the same company and day got there first
+        shutil.rmtree(staging_dir, ignore_errors=True)
+
+
+async def dart_search_cached(corp_code, temp_dir, refresh=False):
+    """
+    Like dart_search, but serves the statements from a per-day cache and writes them to temp_dir.
+    temp_dir is expected to outlive a single report, so statements already written there today are reused as is.
+    With refresh, both the cached statements and the copy in temp_dir are dropped and downloaded again.
+    """
+    date_bucket = date.today().isoformat()
+    folder_name = os.path.join(temp_dir, f"{corp_code}_{date_bucket}_my_docs")
+    if refresh:
+        _fetch_dart_statements.clear(corp_code, date_bucket)
+        await asyncio.to_thread(shutil.rmtree, folder_name, ignore_errors=True)
+    elif await asyncio.to_thread(os.path.isdir, folder_name):
+        return folder_name
+
+    try:
+        # asyncio.run inside the cached function needs a thread without a running loop
+        statements = await asyncio.to_thread(_fetch_dart_statements, corp_code, date_bucket)
+    except _NoDartStatements:
+        return None
+
+    # Plain file writes block, so they run off the event loop like the DART calls
+    await asyncio.to_thread(_write_statement_files, folder_name, statements)
+    return folder_name
+
+
 table_format="""
 | **Business #**         | {BusinessNumber}            | **Corp Registration #**  | {CorpRegistrationNumber}    |
 |------------------------|-----------------------------|--------------------------|-----------------------------|
@@ -553,16 +724,15 @@ NUMBER OF EMPLOYEES : ""
 COMPANY TYPE : ""
 
 """
-# MODIFIED: Removed streaming containers from function signature
-async def dart_get_report(query: str, report_source:str, path: str) -> tuple[str, list]:
-    """Generate DART report using GPTResearcher asynchronously."""
-    # if not path: # Handle case where dart_search might have returned None
-    #     return "Error: Document path not available for DART report generation.", [], ""
 
-    if path:
-        query = f"""
+
+# Fixed parts of the DART research query, built once at import instead of on every report.
+# The table placeholders ({BusinessNumber}, ...) are meant for the LLM, so the query is
+# concatenated rather than passed through str.format.
+_DART_QUERY_PREFIX = """
                 Use this tone for report generation : Simple/Factual tone
-                {query} 
+                """
+_DART_DOCS_QUERY_SUFFIX = f""" 
                 -In References, Must include Dart fss **ANNUAL REPORT** filing of company.
 
                 For the first page of report add Table with this data {table_data} put the value and information of these after you generate the report and have their value.
@@ -570,45 +740,118 @@ async def dart_get_report(query: str, report_source:str, path: str) -> tuple[str
                 if you dont have any value for them then write "N/A" in table. 
                 if Corporate History data is not available of some years then just write those which are available.
                 """
-        os.environ['DOC_PATH'] = path  # GPTResearcher might pick this up
-        researcher = GPTResearcher(query=query, report_type="research_report", report_source="hybrid",
-                                   config_path="config_kr.json")
-        researcher.cfg.load_config("config_kr.json")  # Or path to your config file
-        await researcher.conduct_research()
-        report = await researcher.write_report()
-        research_images = []
-        return report, research_images, ""
-    else:
-        query = f"""
-                Use this tone for report generation : Simple/Factual tone
-                {query} 
+_DART_WEB_QUERY_SUFFIX = f""" 
                 
                 For the first page of report add Table with this data {table_data} put the value and information of these after you generate the report and have their value.
                 Table format should be like this: {table_format}
                 if you dont have any value for them then write "N/A" in table. 
                 if Corporate History data is not available of some years then just write those which are available.
                 """
-        researcher = GPTResearcher(query=query, report_type="research_report",config_path="config_kr.json")
-        researcher.cfg.load_config("config_kr.json")
-        await researcher.conduct_research()
-        report = await researcher.write_report()
-        research_images = []
-        return report, research_images, ""
 
 
-    # COMMENTED OUT: StreamlitLogHandler for streaming logs
-    # logs_handler = StreamlitLogHandler(logs_container, report_container)
+# In-flight dart_get_report calls shared across sessions. Each session runs its own event loop,
+# so followers wait on a thread-safe concurrent.futures.Future rather than an asyncio one.
+_inflight_dart_reports = {}
+_inflight_dart_reports_lock = threading.Lock()
 
-    # MODIFIED: Removed websocket parameter (streaming handler)
 
+async def dart_get_report_coalesced(query: str, report_source: str, path: str,
+                                    logs_container=None, report_container=None) -> tuple[str, list]:
+    """
+    dart_get_report, but identical requests already running (from any session) are joined
+    instead of starting another research run. Only the caller that starts the run gets streaming output.
+    """
+    key = (query, report_source, path)
+    with _inflight_dart_reports_lock:
+        future = _inflight_dart_reports.get(key)
+        is_leader = future is None
+        if is_leader:
+            future = concurrent.futures.Future()
+            _inflight_dart_reports[key] = future
+    if not is_leader:
+        return await asyncio.wrap_future(future)
 
+    try:
+        result = await dart_get_report(query=query, report_source=report_source, path=path,
+                                       logs_container=logs_container, report_container=report_container)
+        future.set_result(result)
+        return result
+    except BaseException as e:
+        future.set_exception(e)
+        raise
+    finally:
+        with _inflight_dart_reports_lock:
+            _inflight_dart_reports.pop(key, None)
+
+
+def _new_dart_web_researcher(query, logs_handler):
+    """GPTResearcher for a DART report from web sources only."""
+    researcher = GPTResearcher(query=_DART_QUERY_PREFIX + query + _DART_WEB_QUERY_SUFFIX, report_type="research_report",
+                               config_path="config_kr.json", websocket=logs_handler)
+    researcher.cfg.load_config("config_kr.json")
+    return researcher
+
+
+async def dart_search_with_web_fallback(corp_code, temp_dir, query: str,
+                                        logs_container=None, report_container=None, refresh=False):
+    """
+    Runs dart_search_cached while the web-only research for the fallback report is already underway.
 
-    # COMMENTED OUT: Report container info messages
-    # report_container.info("Starting research... This may take a few minutes. ⏳")
-    # report_container.info("Writing report... This may take a few minutes. ⏳")
+    Returns (doc_path, None) when DART has documents; the web research is cancelled and the caller
+    generates the hybrid report. Otherwise returns (None, (report, images, logs)) from the web research,
+    so the fallback doesn't have to wait for the DART download before it starts.
+    refresh is passed on to dart_search_cached.
+    """
+    logs_handler = make_log_handler(logs_container, report_container)
+    researcher = _new_dart_web_researcher(query, logs_handler)
+    web_task = asyncio.create_task(researcher.conduct_research())
+    try:
+        doc_path = await dart_search_cached(corp_code, temp_dir, refresh=refresh)
+    except BaseException:
+        web_task.cancel()
+        raise
+    if doc_path:
+        web_task.cancel()
+        # Let the cancelled research unwind before the hybrid run reuses the containers
+        await asyncio.wait({web_task})
+        return doc_path, None
+
+    await web_task
+    report = await researcher.write_report()
+    if logs_handler:
+        logs_handler.flush()
+    return None, (report, [], logs_handler.logs if logs_handler else "")
 
-    # report_container.info("Generating report images... This may take a few minutes. ⏳")
-    # research_images = researcher.get_research_images()
 
-    # MODIFIED: Return empty string for logs since streaming is disabled
-    # return report, research_images, ""
+async def dart_get_report(query: str, report_source:str, path: str,
+                          logs_container=None, report_container=None) -> tuple[str, list]:
+    """
+    Generate DART report using GPTResearcher asynchronously.
+
+    When Streamlit containers are given, research logs and the report are streamed
+    into them while the researcher runs; the logs are also returned as the third element.
+    """
+    logs_handler = make_log_handler(logs_container, report_container)
+    # if not path: # Handle case where dart_search might have returned None
+    #     return "Error: Document path not available for DART report generation.", [], ""
+
+    if path:
+        query = _DART_QUERY_PREFIX + query + _DART_DOCS_QUERY_SUFFIX
+        os.environ['DOC_PATH'] = path  # GPTResearcher might pick this up
+        researcher = GPTResearcher(query=query, report_type="research_report", report_source="hybrid",
+                                   config_path="config_kr.json", websocket=logs_handler)
+        researcher.cfg.load_config("config_kr.json")  # Or path to your config file
+        await researcher.conduct_research()
+        report = await researcher.write_report()
+        if logs_handler:
+            logs_handler.flush()
+        research_images = []
+        return report, research_images, logs_handler.logs if logs_handler else ""
+    else:
+        researcher = _new_dart_web_researcher(query, logs_handler)
+        await researcher.conduct_research()
+        report = await researcher.write_report()
+        if logs_handler:
+            logs_handler.flush()
+        research_images = []
+        return report, research_images, logs_handler.logs if logs_handler else ""
@@ -0,0 +1,210 @@
+import contextlib
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+CACHE_ROOT = os.path.join(".cache", "reports")
+REPORT_DATA_FILE = "report_data.json"
+REPORT_FILE = "report.md"
+MANIFEST_FILE = "manifest.json"
+REPORT_DOCX_FILE = "report.docx"
+PARTS_DIR = "parts"
+REPORT_STORE_MAX_ENTRIES = int(os.getenv("REPORT_STORE_MAX_ENTRIES", "50"))
+# Finished reports are resumed for a week, individual pipeline steps for a day
+# (the same as the DART and SEC lookups they wrap)
+REPORT_CACHE_TTL_SECONDS = int(os.getenv("REPORT_CACHE_TTL_SECONDS", "604800"))
+REPORT_PART_TTL_SECONDS = int(os.getenv("REPORT_PART_TTL_SECONDS", "86400"))
+
+
+def report_cache_key(company_url: str, language: str) -> str:
+    """Returns the SHA256 cache key for a (company_url, language) pair."""
+    return hashlib.sha256(f"{company_url}|{language}".encode("utf-8")).hexdigest()
+
+
+def _write_json(file_path, data):
+    """
+    Writes JSON atomically so a crash mid-write never leaves a half-written entry.
+    The temp file name is unique, since two sessions may persist the same key at once.
+    """
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(file_path), suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False, default=str)
+        os.replace(tmp_path, file_path)
+    except BaseException:
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(tmp_path)
+        raise
+
+
+def _read_json(file_path):
+    try:
+        with open(file_path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+
+class Cacher():
+    """
+    Persists generated reports on disk so they survive reruns, sessions and restarts.
+
+    Each entry lives under <root>/<key>/:
+        report_data.json  - the report_data dict without report text and images
+        report.md         - the report markdown, referenced by report_data['report_path']
+        manifest.json     - list of images, binary ones stored as separate files, and when the entry expires
+        image_<n>.bin     - binary images, referenced from report_data['images'] by path
+        report.docx       - the DOCX download, built on first request
+        parts/<name>.json - results of individual pipeline steps
+
+    Expired entries are ignored by resume / resume_part and overwritten by the next persist.
+    """
+    def __init__(self, root: str = CACHE_ROOT, ttl_seconds: int = REPORT_CACHE_TTL_SECONDS,
+                 part_ttl_seconds: int = REPORT_PART_TTL_SECONDS):
+        self.root = root
+        self.ttl_seconds = ttl_seconds
+        self.part_ttl_seconds = part_ttl_seconds
+
+    def _entry_dir(self, key):
+        return os.path.join(self.root, key)
+
+    def persist(self, key: str, report_data: dict, ttl_seconds: int = None) -> dict:
+        """
+        Stores a finished report_data dict under key, replacing an earlier one.
+
+        The entry is resumed for ttl_seconds (the cacher's ttl_seconds by default); with 0 it is
+        written for serving the report and its files but never resumed.
+        Returns the stored view of report_data, where the report text is
+        replaced by 'report_path' and binary images by their file paths,
+        so neither has to stay in memory.
+        """
+        entry_dir = self._entry_dir(key)
+        os.makedirs(entry_dir, exist_ok=True)
+        # Files built from or belonging to a previous version of the report.
+        # A session persisting the same key at the same time may have removed them already
+        for file_name in os.listdir(entry_dir):
+            if file_name == REPORT_DOCX_FILE or file_name.startswith("image_"):
+                with contextlib.suppress(FileNotFoundError):
+                    os.remove(os.path.join(entry_dir, file_name))
+        if ttl_seconds is None:
+            ttl_seconds = self.ttl_seconds
+
+        data = dict(report_data)
+        if 'report' in data:
+            report_path = os.path.join(entry_dir, REPORT_FILE)
+            with open(report_path, "w", encoding="utf-8") as f:
+                f.write(data.pop('report') or "")
+            data['report_path'] = report_path
+
+        images = data.pop('images', None) or []
+        manifest = []
+        image_refs = []
+        for i, image in enumerate(images):
+            if isinstance(image, (bytes, bytearray)):
+                file_name = f"image_{i}.bin"
+                image_path = os.path.join(entry_dir, file_name)
+                with open(image_path, "wb") as f:
+                    f.write(image)
+                manifest.append({"type": "file", "value": file_name})
+                image_refs.append(image_path)
+            else:
+                # URLs / paths returned by the researcher are kept inline
+                manifest.append({"type": "inline", "value": image})
+                image_refs.append(image)
+
+        # Manifest first: report_data.json is what marks the entry as complete
+        _write_json(os.path.join(entry_dir, MANIFEST_FILE), {"images": manifest, "expires_at": time.time() + ttl_seconds})
+        _write_json(os.path.join(entry_dir, REPORT_DATA_FILE), data)
+
+        data['images'] = image_refs
+        return data
+
+    def resume(self, key: str):
+        """Returns the cached report_data dict for key, or None on a miss or once it expired. Binary images are returned as file paths."""
+        entry_dir = self._entry_dir(key)
+        manifest = _read_json(os.path.join(entry_dir, MANIFEST_FILE))
+        # Entries written before expiry was tracked count as expired
+        if manifest is None or manifest.get("expires_at", 0) <= time.time():
+            return None
+        data = _read_json(os.path.join(entry_dir, REPORT_DATA_FILE))
+        if data is None:
+            return None
+        if 'report_path' in data and not os.path.exists(data['report_path']):
+            return None
+
+        images = []
+        for image in manifest.get("images", []):
+            if image["type"] == "file":
+                image_path = os.path.join(entry_dir, image["value"])
+                if not os.path.exists(image_path):
+                    # An image went missing, treat the whole entry as stale
+                    return None
+                images.append(image_path)
+            else:
+                images.append(image["value"])
+        data['images'] = images
+        return data
+
+    def file_path(self, key: str, file_name: str) -> str:
+        """Returns the path of file_name inside the entry for key, creating the entry directory if needed."""
+        entry_dir = self._entry_dir(key)
+        os.makedirs(entry_dir, exist_ok=True)
+        return os.path.join(entry_dir, file_name)
+
+    def persist_part(self, key: str, name: str, value) -> None:
+        """Stores the result of a single pipeline step (e.g. sec_search) under key."""
+        if value is None:
+            return
+        parts_dir = os.path.join(self._entry_dir(key), PARTS_DIR)
+        os.makedirs(parts_dir, exist_ok=True)
+        _write_json(os.path.join(parts_dir, f"{name}.json"), {"value": value})
+
+    def resume_part(self, key: str, name: str):
+        """Returns the cached result of a single pipeline step, or None on a miss or once it is older than part_ttl_seconds."""
+        part_path = os.path.join(self._entry_dir(key), PARTS_DIR, f"{name}.json")
+        try:
+            if time.time() - os.path.getmtime(part_path) > self.part_ttl_seconds:
+                return None
+        except FileNotFoundError:
+            return None
+        part = _read_json(part_path)
+        return part["value"] if part else None
+
+
+class ReportStore():
+    """
+    Process-wide LRU of loaded report_data dicts in front of a Cacher.
+
+    Sessions only keep cache keys; the full report_data (images as file paths) is loaded
+    from disk on demand, and at most max_entries of them stay in memory.
+    Returned dicts are shared between sessions and must not be mutated.
+    Reports persisted with ttl_seconds=0 can't be reloaded once evicted, so sessions keep those themselves.
+    """
+    def __init__(self, cacher: Cacher, max_entries: int = REPORT_STORE_MAX_ENTRIES):
+        self.cacher = cacher
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def put(self, key: str, report_data: dict) -> None:
+        with self._lock:
+            self._entries[key] = report_data
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def get(self, key: str):
+        """Returns the report_data for key, loading it from disk on a miss, or None if it's gone."""
+        with self._lock:
+            report_data = self._entries.get(key)
+            if report_data is not None:
+                self._entries.move_to_end(key)
+                return report_data
+        report_data = self.cacher.resume(key)
+        if report_data is not None:
+            self.put(key, report_data)
+        return report_data
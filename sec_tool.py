@@ -1,7 +1,8 @@
 from sec_extractor import sec_section_extractor
 from sec_filings_query import query_sec_filings
 from sec_full_text_search import sec_full_text_search
-from google.genai import types, Client
+from google.genai import types
+from google_client import get_google_client
 import os
 from dotenv import load_dotenv
 load_dotenv()
@@ -34,7 +35,7 @@ def sec_tool_function(query: str) -> str:
     Returns:
         str: The answer to the query provided to the tool based on information in the SEC filings documents.
     """
-    client = Client()
+    client = get_google_client()
 
     config = types.GenerateContentConfig(
         tools=[sec_section_extractor, sec_full_text_search],
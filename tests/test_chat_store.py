@@ -0,0 +1,86 @@
+import json
+import os
+import tempfile
+import unittest
+from types import SimpleNamespace
+
+from chat_store import ChatStore, serialize_history
+
+
+class ChatStoreOwnerTest(unittest.TestCase):
+    """Two sessions sharing one ChatStore must never see or delete each other's rows."""
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.store = ChatStore(os.path.join(self.tmp_dir.name, "chat_store.sqlite3"))
+        self.doc_path = os.path.join(self.tmp_dir.name, "doc.txt")
+        with open(self.doc_path, "w", encoding="utf-8") as f:
+            f.write("private")
+
+    def tearDown(self):
+        self.store._conn.close()
+        self.tmp_dir.cleanup()
+
+    def test_files_are_scoped_to_owner(self):
+        self.store.record_file("alice", "doc.txt-id", "doc.txt", self.doc_path)
+        self.assertEqual([file["id"] for file in self.store.list_files("alice")], ["doc.txt-id"])
+        self.assertEqual(self.store.list_files("bob"), [])
+        self.assertIsNone(self.store.file_path("bob", "doc.txt-id"))
+
+    def test_chats_are_scoped_to_owner(self):
+        self.store.record_chat("alice", "chat-a", "Chat 1", ["doc.txt-id"])
+        self.store.append_messages("alice", "chat-a", [("user", '[{"text": "hello"}]')])
+        self.assertEqual([chat["chat_id"] for chat in self.store.list_chats("alice")], ["chat-a"])
+        self.assertEqual(self.store.list_chats("bob"), [])
+        self.assertEqual(self.store.load_messages("bob", "chat-a", 10), [])
+        self.assertEqual(self.store.count_messages("bob", "chat-a"), 0)
+
+    def test_other_owner_cannot_write_or_delete(self):
+        self.store.record_chat("alice", "chat-a", "Chat 1", [])
+        self.store.append_messages("bob", "chat-a", [("user", '[{"text": "injected"}]')])
+        self.store.delete_chat("bob", "chat-a")
+        self.assertEqual([chat["chat_id"] for chat in self.store.list_chats("alice")], ["chat-a"])
+        self.assertEqual(self.store.count_messages("alice", "chat-a"), 0)
+
+
+
+def _part(text=None, function_call=None, function_response=None):
+    return SimpleNamespace(text=text, thought=None, function_call=function_call, function_response=function_response)
+
+
+class SerializeHistoryTest(unittest.TestCase):
+    """Streamed chunks are stored as one turn that keeps every part."""
+
+    def test_streamed_chunks_merge_into_one_turn(self):
+        call_a = SimpleNamespace(name="search_a", args={"q": "x"})
+        call_b = SimpleNamespace(name="search_b", args={"q": "y"})
+        history = [
+            SimpleNamespace(role="user", parts=[_part(text="question")]),
+            SimpleNamespace(role="model", parts=[_part(text="Let me ")]),
+            SimpleNamespace(role="model", parts=[_part(text="check."), _part(function_call=call_a)]),
+            SimpleNamespace(role="model", parts=[_part(function_call=call_b)]),
+            SimpleNamespace(role="user", parts=[
+                _part(function_response=SimpleNamespace(name="search_a", response={"result": 1})),
+                _part(function_response=SimpleNamespace(name="search_b", response={"result": 2})),
+            ]),
+            SimpleNamespace(role="model", parts=[_part(text="Done")]),
+            SimpleNamespace(role="model", parts=[_part(text=".")]),
+        ]
+        rows = [(role, json.loads(parts)) for role, parts in serialize_history(history)]
+        self.assertEqual(rows, [
+            ("user", [{"text": "question"}]),
+            ("model", [
+                {"text": "Let me check."},
+                {"function_call": {"name": "search_a", "args": {"q": "x"}}},
+                {"function_call": {"name": "search_b", "args": {"q": "y"}}},
+            ]),
+            ("user", [
+                {"function_response": {"name": "search_a", "response": {"result": 1}}},
+                {"function_response": {"name": "search_b", "response": {"result": 2}}},
+            ]),
+            ("model", [{"text": "Done."}]),
+        ])
+
+
+if __name__ == "__main__":
+    unittest.main()
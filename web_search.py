@@ -1,6 +1,14 @@
 from tavily import TavilyClient
+import functools
 import os
 
+
+@functools.lru_cache(maxsize=None)
+def get_tavily_client() -> TavilyClient:
+    """Returns the process-wide Tavily client so searches reuse its connection pool."""
+    return TavilyClient(api_key=os.getenv("TAVILY_API_KEY"))
+
+
 def web_search_tool(query:str) -> str:
     """Web-Search Tool. Use it to find answer to queries from the Internet
 
@@ -10,7 +18,7 @@ def web_search_tool(query:str) -> str:
     Returns:
         str: Answer to query based on web search results
     """
-    client = TavilyClient(api_key=os.getenv("TAVILY_API_KEY"))
+    client = get_tavily_client()
     response = client.search(query=query, include_answer=True)
 
     return response.get('answer')